@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+'''
+BURP benchmark - times the reporting pipeline on synthetic IXON exports.
+
+Generates exports with the columns a site's recipe reads, at a given sample rate, duration and trip density,
+and times StandardizedReport and ExportToExcel end to end and per stage (StageProfiler). The results are written
+as json together with the commit they were measured on, so runs of different commits can be compared:
+
+    python BURP_benchmark.py --site B0933 --rate 10s 1min --duration 1D 30D --output before.json
+    python BURP_benchmark.py --site B0933 --rate 10s 1min --duration 1D 30D --output after.json --compare before.json
+
+With --startup only the start up of the program is timed: the import of BURP_v9 in a fresh interpreter, which
+should not load pandas, and the background warm up of the libraries.
+'''
+
+#%% Import required libraries
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+import BURP_v9 as burp
+
+#%% Synthetic exports
+
+'''
+Signals of the generated exports, columns that are not listed here get a noisy signal around 100.
+State codes, as the availability KPIs count them (calculate_availability): SEQSTATE runs in 62, stands by in 1 and
+trips in 90/99, SEQSTATE_CO2 runs in 20, stands by in 2 and trips in 90/99. The CO2 liquefaction and the heat pump
+run in 3, stand by in 1 and trip in 5.
+'''
+
+SIGNALS = {
+    # column: (mean, standard deviation)
+    'RHA10CF001': (500, 20),
+    'NormalFlow': (300, 10),
+    'RHH10_CH4': (97, 1),
+    'RHH15_CH4': (60, 5),
+    'RHM50AN001': (50, 5),
+    'RHM50AA106': (20, 5),
+    'Methane_slip': (0.5, 0.1),
+    'Methane_slip_factor': (90, 3),
+    'H2S_in': (20, 10),
+    }
+
+STATES = {
+    # column: (running, standby, trip codes)
+    'SEQSTATE': (62, 1, (90, 99)),
+    'SEQSTATE_CO2': (20, 2, (90, 99)),
+    'CO2LIQ': (3, 1, (5,)),
+    'Heatpump': (3, 1, (5,)),
+    }
+
+def state_series(rng, n, step, trips_per_day, running, standby, trip_codes):
+    '''
+    State codes for n samples of step seconds: running, interrupted by trips (1 to 30 minutes) at the given rate per
+    day and standby periods (1 to 4 hours) at a tenth of that rate.
+    '''
+    
+    states = np.full(n, running, dtype = np.uint8)
+    days = n*step/86400
+    
+    for count, code, duration in ((rng.poisson(trips_per_day*days), None, (60, 1800)),
+                                  (rng.poisson(trips_per_day*days/10), standby, (3600, 14400))):
+        starts = rng.integers(0, n, count)
+        lengths = np.maximum(1, rng.integers(*duration, count)//step)
+        codes = rng.choice(trip_codes, count) if code is None else np.full(count, code)
+        for start, length, code in zip(starts, lengths, codes):
+            states[start:start+length] = code
+    
+    return states
+
+def generate_export(file_location, columns, rate = '10s', duration = '30D', trips_per_day = 2, sparsity = 0.3,
+                    start = '2024-01-01', seed = 0, chunksize = 1000000):
+    '''
+    Writes a synthetic IXON export with the given columns and returns the number of rows.
+    
+    Energy* columns are increasing kWh counters, the state columns follow state_series and the other columns are
+    noisy signals. A fraction sparsity of the values is left empty, like the unchanged values of an IXON export.
+    The signals are written with 6 significant digits, the counters (around 1e6 kWh) with 10 so their steps are kept.
+    The file is written in chunks so a year at 1 s does not have to fit in memory as text.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    step = int(pd.Timedelta(rate).total_seconds())
+    n = int(pd.Timedelta(duration).total_seconds()//step)
+    start = pd.Timestamp(start)
+    
+    states = {column: state_series(rng, n, step, trips_per_day, *STATES[column]) for column in columns if column in STATES}
+    counters = {column: 1e6 + rng.random()*1e5 for column in columns if column.startswith('Energy')}
+    
+    with open(file_location, 'w', newline = '') as file:
+        for offset in range(0, n, chunksize):
+            size = min(chunksize, n - offset)
+            chunk = {'time': (start + pd.to_timedelta(np.arange(offset, offset+size)*step, unit = 's')).strftime('%Y-%m-%d %H:%M:%S')}
+            
+            for column in columns:
+                if column in states:
+                    values = states[column][offset:offset+size].astype(np.float32)
+                elif column in counters:
+                    values = counters[column] + np.cumsum(rng.random(size)*step/10)
+                    counters[column] = values[-1]
+                else:
+                    mean, deviation = SIGNALS.get(column, (100, 10))
+                    values = rng.normal(mean, deviation, size).astype(np.float32)
+                
+                empty = rng.random(size) < sparsity
+                if column in counters:
+                    chunk[column] = np.where(empty, '', pd.Series(values).map('{:.10g}'.format).to_numpy(dtype = str))
+                else:
+                    chunk[column] = np.where(empty, np.nan, values)
+            
+            pd.DataFrame(chunk).to_csv(file, index = False, header = offset == 0, float_format = '%.6g')
+    
+    return n
+
+#%% Benchmark
+
+def git_commit():
+    '''Commit hash of the working tree, with -dirty when it has uncommitted changes, None outside a git repository'''
+    
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = folder, capture_output = True, text = True, check = True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = folder, capture_output = True, text = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+STARTUP = '''
+import sys, time
+start = time.perf_counter()
+import BURP_v9
+imported = time.perf_counter()
+loaded = 'pandas.core' in sys.modules
+BURP_v9.warm_up()
+print(imported - start, loaded, time.perf_counter() - imported)
+'''
+
+def startup_time(repeat = 5):
+    '''Start up of the program in fresh interpreters, the fastest of repeat runs'''
+    
+    folder = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP], cwd = folder, capture_output = True, text = True, check = True).stdout.split()
+        runs.append({'process_seconds': round(time.perf_counter() - start, 4), 'import_seconds': round(float(output[0]), 4),
+                     'pandas_loaded_on_import': output[1] == 'True', 'warm_up_seconds': round(float(output[2]), 4)})
+    
+    return min(runs, key = lambda run: run['import_seconds'])
+
+def run_case(site, file_location, folder_location, repeat = 1, memory = False, cache = False, aggregation = None):
+    '''
+    Creates the report of a generated export repeat times and returns the fastest run: the total time and the time of
+    each stage. With cache the first run fills the export cache and the timed runs read from it.
+    '''
+    
+    runs = []
+    cache = burp.ExportCache(os.path.join(folder_location, 'cache')) if cache else False
+    if cache:
+        burp.StandardizedReport(site, file_location, folder_location, cache = cache, aggregation = aggregation)
+    
+    for _ in range(repeat):
+        profiler = burp.StageProfiler(memory = memory)
+        start = time.perf_counter()
+        report = burp.StandardizedReport(site, file_location, folder_location, cache = cache, profiler = profiler, aggregation = aggregation)
+        burp.ExportToExcel(report, interactive = False)
+        runs.append({'seconds': round(time.perf_counter() - start, 4), 'stages': profiler.stages})
+        profiler.stop()
+    
+    return min(runs, key = lambda run: run['seconds'])
+
+def benchmark(args):
+    '''Runs every combination of site, rate, duration and trip density and returns the results'''
+    
+    results = {
+        'commit': git_commit(),
+        'version': burp.__version__,
+        'date': datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'aggregation': args.aggregation,
+        'cases': [],
+        }
+    
+    if args.startup:
+        results['startup'] = startup = startup_time(args.repeat)
+        print(f"start up {startup['import_seconds']:.3f} s import, {startup['warm_up_seconds']:.3f} s warm up, {startup['process_seconds']:.3f} s process"
+              + (' (pandas loaded on import)' if startup['pandas_loaded_on_import'] else ''))
+        return results
+    
+    folder_location = tempfile.mkdtemp(prefix = 'burp_benchmark_')
+    
+    try:
+        for site in map(burp.resolve_site, args.site):
+            columns = burp.load_recipes().get(site).columns
+            for rate in args.rate:
+                for duration in args.duration:
+                    for trips in args.trips:
+                        file_location = os.path.join(folder_location, 'export.csv')
+                        rows = generate_export(file_location, columns, rate, duration, trips, seed = args.seed)
+                        
+                        case = {'site': site, 'rate': rate, 'duration': duration, 'trips_per_day': trips, 'rows': rows,
+                                'file_mb': round(os.path.getsize(file_location)/1024**2, 1)}
+                        case.update(run_case(site, file_location, folder_location, args.repeat, args.memory, args.cache, args.aggregation))
+                        results['cases'].append(case)
+                        
+                        print(f"{site.split(' - ')[0]:9} {rate:>5} {duration:>5} {trips:>4g} trips/day {rows:>10} rows  {case['seconds']:8.2f} s")
+    finally:
+        shutil.rmtree(folder_location, ignore_errors = True)
+    
+    return results
+
+def case_key(case):
+    return (case['site'], case['rate'], case['duration'], case['trips_per_day'])
+
+def compare(results, baseline):
+    '''Prints the time of each stage relative to an earlier benchmark with the same cases'''
+    
+    earlier = {case_key(case): case for case in baseline['cases']}
+    print(f"\nCompared to {baseline.get('commit')} (ratio new/old, lower is faster)")
+    
+    if 'startup' in results and 'startup' in baseline:
+        for key in ('import_seconds', 'warm_up_seconds', 'process_seconds'):
+            if baseline['startup'][key]:
+                print(f"start up {key:22} {baseline['startup'][key]:8.3f} s -> {results['startup'][key]:8.3f} s  {results['startup'][key]/baseline['startup'][key]:6.2f}")
+    
+    for case in results['cases']:
+        old = earlier.get(case_key(case))
+        if old is None:
+            continue
+        print(f"{case['site'].split(' - ')[0]:9} {case['rate']:>5} {case['duration']:>5} {case['trips_per_day']:>4g} trips/day  total {case['seconds']/old['seconds']:6.2f}")
+        old_stages = {stage['stage']: stage['seconds'] for stage in old['stages']}
+        for stage in case['stages']:
+            if old_stages.get(stage['stage']):
+                print(f"    {stage['stage']:34} {old_stages[stage['stage']]:8.3f} s -> {stage['seconds']:8.3f} s  {stage['seconds']/old_stages[stage['stage']]:6.2f}")
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark of the BURP reporting pipeline on synthetic exports')
+    parser.add_argument('--site', nargs = '+', default = ['B0933'], help = 'site names or codes')
+    parser.add_argument('--rate', nargs = '+', default = ['10s', '1min'], help = 'sample rates, from 1s to 5min')
+    parser.add_argument('--duration', nargs = '+', default = ['1D', '30D'], help = 'durations, from 1D to 365D')
+    parser.add_argument('--trips', nargs = '+', type = float, default = [2], help = 'trips per day')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per case, the fastest run is kept')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--memory', action = 'store_true', help = 'also record the peak memory of the stages (slower)')
+    parser.add_argument('--cache', action = 'store_true', help = 'time the reports with a filled export cache')
+    parser.add_argument('--aggregation', choices = burp.AGGREGATIONS, help = 'aggregation of the reports, default from the recipe of the site')
+    parser.add_argument('--startup', action = 'store_true', help = 'only time the start up of the program')
+    parser.add_argument('--max-startup', type = float, help = 'with --startup, fail when the import takes longer than this (seconds)')
+    parser.add_argument('--output', help = 'json file for the results')
+    parser.add_argument('--compare', help = 'json file of an earlier benchmark to compare with')
+    args = parser.parse_args(argv)
+    
+    results = benchmark(args)
+    
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent = 2)
+    
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+    
+    if args.startup and args.max_startup and results['startup']['import_seconds'] > args.max_startup:
+        print(f"start up is slower than {args.max_startup} s")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
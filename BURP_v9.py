@@ -12,18 +12,1302 @@ Creates standardized reportsfor customers.
 #%% Import required libraries
 
 import os
+import re
+import sys
+import csv
+import glob
 import math
+import json
+import time
+import pickle
+import shutil
+import signal
+import hashlib
+import argparse
+import importlib.util
+import threading
+import tracemalloc
+from abc import ABC, abstractmethod
 from datetime import date
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 
+import queue
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import Border, Side
+def lazy_import(name):
+    '''
+    Imports a module on first use. pandas and numpy take most of the start up time, the GUI only needs them once a
+    report starts. openpyxl is imported in the functions that write the workbooks.
+    '''
+    
+    if name in sys.modules:
+        return sys.modules[name]
+    
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+def warm_up():
+    '''Loads the analysis and export libraries and the templates, the GUI runs this in the background once the window is shown'''
+    
+    pd.DataFrame, np.ndarray
+    templates.preload(template.file for template in load_recipes().templates.values())
+
+#%% Column schema of the IXON exports
+
+'''
+Only the columns a site's report uses are read from the export, these follow from the recipe of the site.
+Analog tags are read as float32, state codes are stored as uint8 once the gaps are filled.
+Energy counters stay float64, float32 can not hold a kWh counter with enough digits.
+'''
+
+STATE_COLUMNS = ('SEQSTATE', 'SEQSTATE_CO2', 'CO2LIQ', 'Heatpump')
+
+CHUNK_SIZE = 500000 # rows per chunk when reading an export
+
+def column_dtype(column_name):
+    '''dtype used while reading a column, state codes are read as float32 because they contain gaps'''
+    
+    if column_name.startswith('Energy'):
+        return np.float64
+    return np.float32
+
+def count_lines(file_location, block_size = 1 << 20, offset = 0):
+    '''Number of lines of a file from offset (counted in blocks of bytes), an upper bound of the rows of an export'''
+    
+    lines = 1
+    with open(file_location, 'rb') as file:
+        file.seek(offset)
+        while block := file.read(block_size):
+            lines += block.count(b'\n')
+    return lines
+
+def export_end(file_location, block_size = 1 << 16):
+    '''
+    The byte offset after the last line of an export and a hash of that line, to skip the lines that were read
+    before when the export has grown (see read_export and MonthToDateReport)
+    '''
+    
+    with open(file_location, 'rb') as file:
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(0, size - block_size))
+        tail = file.read()
+    
+    line = tail.rstrip(b'\r\n').rsplit(b'\n', 1)[-1]
+    return {'offset': size, 'length': len(tail) - len(tail.rstrip(b'\r\n')) + len(line),
+            'hash': hashlib.blake2b(line, digest_size = 16).hexdigest()}
+
+def export_offset(file_location, end):
+    '''The offset of an earlier export_end when the export still has that line there, else 0 (read it all)'''
+    
+    if not end:
+        return 0
+    with open(file_location, 'rb') as file:
+        if file.seek(0, os.SEEK_END) < end['offset']:
+            return 0
+        file.seek(end['offset'] - end['length'])
+        line = file.read(end['length']).rstrip(b'\r\n')
+    return end['offset'] if hashlib.blake2b(line, digest_size = 16).hexdigest() == end['hash'] else 0
+
+def read_export(file_location, columns = None, chunksize = CHUNK_SIZE, stream_fill = True, since = None, initial = None, offset = 0):
+    '''
+    Reads an IXON export in chunks of a fixed number of rows.
+    
+    Only the time column and the given columns are read (all columns when columns is None), with the dtypes of
+    column_dtype and the timestamps parsed while reading. As long as the export is in chronological order the gaps
+    are forward filled chunk by chunk, carrying the last row of a chunk into the next one. An export that is not
+    in order is sorted and filled as a whole after reading.
+    
+    To continue earlier data: rows up to and including the time since are skipped, and initial (the last filled
+    row of the earlier data, a Series with a time) fills the gaps at the start instead of a backward fill.
+    With offset (bytes, see export_offset) the lines before it are not read at all, only the header.
+    
+    The chunks are copied into columns that are allocated once for the number of lines of the file, so the data
+    is never held twice (joining chunks would). Memory of rows that are skipped is allocated but never touched.
+    State codes are stored as uint8 while reading, before the first recorded state of a column its rows are
+    counted and filled backward at the end.
+    
+    Returns the sorted and filled frame, with the state columns as uint8.
+    '''
+    
+    header = pd.read_csv(file_location, nrows = 0).columns
+    usecols = [column for column in header if column == 'time' or columns is None or column in columns]
+    schema = {column: column_dtype(column) for column in usecols if column != 'time'}
+    
+    names = {'names': list(header), 'header': None} if offset else {} # the header is before the offset
+    
+    data = None # the columns, allocated at the first chunk
+    leading = {} # state column: rows before its first recorded state
+    rows = 0
+    carry = initial # last (filled) row of the previous chunk
+    ordered = stream_fill
+    
+    with open(file_location, 'rb') as source:
+        source.seek(offset)
+        for chunk in pd.read_csv(source, usecols = usecols, dtype = schema, parse_dates = ['time'], chunksize = chunksize, **names):
+            
+            if since is not None:
+                chunk = chunk[chunk['time'] > since]
+                if chunk.empty:
+                    continue
+            
+            if ordered and not (chunk['time'].is_monotonic_increasing and (carry is None or chunk['time'].iloc[0] >= carry['time'])):
+                if rows:
+                    # Chunks that were already filled are out of order, start again and fill after sorting
+                    return read_export(file_location, columns, chunksize, False, since, initial, offset)
+                ordered = False
+            
+            if ordered:
+                chunk = chunk.ffill()
+                if carry is not None:
+                    chunk = chunk.fillna(carry.drop('time', errors = 'ignore'))
+                carry = chunk.iloc[-1]
+            
+            if data is None:
+                lines = count_lines(file_location, offset = offset)
+                data = {column: np.empty(lines, dtype = 'datetime64[ns]' if column == 'time' else np.uint8 if ordered and column in STATE_COLUMNS else schema[column])
+                        for column in usecols}
+            
+            for column in usecols:
+                values = chunk[column].to_numpy()
+                if data[column].dtype == np.uint8:
+                    missing = np.isnan(values)
+                    if missing.any(): # only before the first recorded state, the gaps after it are forward filled
+                        leading[column] = leading.get(column, 0) + int(missing.sum())
+                        values = np.where(missing, 0, values)
+                data[column][rows:rows+len(chunk)] = values
+            rows += len(chunk)
+            del chunk
+    
+    if not rows:
+        return pd.DataFrame({column: pd.Series(dtype = 'datetime64[ns]' if column == 'time' else schema[column]) for column in usecols})
+    
+    for column, count in leading.items():
+        if count < rows:
+            data[column][:count] = data[column][count]
+        else:
+            data[column] = np.full(rows, np.nan, dtype = schema[column]) # a state that was never recorded
+    
+    df = pd.DataFrame({column: values[:rows] for column, values in data.items()}, copy = False)
+    del data
+    
+    if not ordered:
+        df.sort_values(by = ['time'], inplace = True, kind = 'stable')
+        df.reset_index(drop = True, inplace = True)
+        df.ffill(inplace = True)
+        if initial is not None:
+            df.fillna(initial.drop('time', errors = 'ignore'), inplace = True)
+    
+    df.bfill(inplace = True) # after the ffill only the start of the export can still have gaps
+    
+    for column in STATE_COLUMNS:
+        if column in df.columns and df[column].dtype != np.uint8 and df[column].notna().all():
+            df[column] = df[column].astype(np.uint8)
+    
+    return df
+
+#%% Report recipes
+
+BASE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BaseFiles') # recipes and templates
+
+'''
+Every site has a recipe in BaseFiles/recipes.json (next to this file): the KPIs to compute, the template to fill in and fixed values.
+The cell mapping of each template is declared in the same file. Adding a site that reuses the existing KPIs and
+templates only needs a new entry in the recipes file.
+'''
+
+KPIS = {
+    # name: (method of StandardizedReport, columns it reads)
+    # The columns named by the 'column', 'weight' and 'counters' parameters of a recipe entry are read as well.
+    'biogas': ('calculate_biogas', ['SEQSTATE', 'RHA10CF001', 'RHH15_CH4']),
+    'biomethane': ('calculate_biomethane', ['SEQSTATE', 'NormalFlow', 'RHH10_CH4']),
+    'capacity': ('calculate_capacity', ['SEQSTATE', 'RHM50AN001', 'RHM50AA106']),
+    'methane_slip_estimate': ('calculate_methane_slip_estimate', []),
+    'operating_hours': ('calculate_operating_hours', ['SEQSTATE']),
+    'unit_availability': ('calculate_unit_availability', []),
+    'energy': ('calculate_energies', []),
+    'methane_slip_measured': ('calculate_methane_slip_measured', ['SEQSTATE', 'SEQSTATE_CO2', 'Methane_slip', 'RHH15_CH4']),
+    'methane_slip_CO2LIQ_active': ('calculate_methane_slip_CO2LIQ_active', ['SEQSTATE', 'SEQSTATE_CO2', 'Methane_slip', 'Methane_slip_factor']),
+    'H2S_treated': ('calculate_H2S_treated', ['SEQSTATE', 'H2S_in', 'RHA10CF001']),
+    'trips_CO2LIQ': ('calculate_trips_CO2LIQ', ['SEQSTATE_CO2']),
+    'metric': ('calculate_metric', []), # a declared Metric, see below
+    }
+
+DEFAULT_KPIS = ['biogas', 'biomethane', 'capacity', 'methane_slip_estimate', 'operating_hours'] # for a site without a recipe
+
+class CellMap:
+    '''
+    Compiled cell mapping of a template, {cell: value} where the value is
+        - a number, written as it is
+        - a string starting with '=', an Excel formula in which {kpi} is replaced by the value of the KPI
+        - any other string, a Python expression of the KPIs, e.g. round(biogas, 1), compiled once when loading
+    '''
+    
+    HELPERS = {
+        'round': round,
+        'str': str,
+        'nvt': lambda x: x if isinstance(x, str) else round(x, 2),
+        'today': lambda: date.today(),
+        }
+    
+    def __init__(self, cells):
+        self.cells = []
+        for cell, value in cells.items():
+            if isinstance(value, str) and value.startswith('='):
+                self.cells.append((cell, 'formula', value))
+            elif isinstance(value, str):
+                self.cells.append((cell, 'expression', compile(value, f'<cell {cell}>', 'eval')))
+            else:
+                self.cells.append((cell, 'constant', value))
+    
+    def values(self, kpis):
+        '''Yields (cell, value) for the given KPI values (a dictionary)'''
+        
+        namespace = dict(self.HELPERS, **kpis)
+        for cell, kind, value in self.cells:
+            if kind == 'formula':
+                yield cell, value.format_map(kpis)
+            elif kind == 'expression':
+                yield cell, eval(value, {'__builtins__': {}}, namespace)
+            else:
+                yield cell, value
+    
+    def fill(self, ws, kpis):
+        for cell, value in self.values(kpis):
+            ws[cell] = value
+
+class Template:
+    '''A report template: the workbook, the first row of its trip table and its cell mapping'''
+    
+    def __init__(self, name, file, trip_table, cells):
+        self.name = name
+        self.file = file
+        self.trip_table = trip_table
+        self.cells = CellMap(cells)
+
+AGGREGATIONS = ('grid', 'time')
+
+class Recipe:
+    '''
+    The recipe of a site: the KPIs (name and parameters) in the order they are computed, the template, fixed values
+    and the aggregation: 'grid' for the 5 minute grid, 'time' for time weighting on the raw timestamps.
+    '''
+    
+    def __init__(self, site, kpis, template = None, values = None, aggregation = 'grid'):
+        self.site = site
+        self.template = template
+        self.values = values or {}
+        
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f'Unknown aggregation {aggregation!r} in the recipe of {site}')
+        self.aggregation = aggregation
+        
+        self.kpis = []
+        for entry in kpis:
+            params = {'kpi': entry} if isinstance(entry, str) else dict(entry)
+            name = params.pop('kpi')
+            if name not in KPIS:
+                raise ValueError(f'Unknown KPI {name!r} in the recipe of {site}')
+            if name == 'metric':
+                Metric(**params) # checks the declaration when loading
+            if name == 'energy' and set(params.get('rollover') or {}) - set(params['counters'].values()):
+                raise ValueError(f'Rollover of a column that is not an energy counter in the recipe of {site}')
+            self.kpis.append((name, params))
+    
+    @property
+    def metrics(self):
+        '''The metrics declared in this recipe'''
+        return [Metric(**params) for name, params in self.kpis if name == 'metric']
+    
+    @property
+    def columns(self):
+        '''The columns of the export that the KPIs of this recipe read'''
+        
+        columns = set()
+        for name, params in self.kpis:
+            columns.update(KPIS[name][1])
+            columns.update(params[key] for key in ('column', 'weight') if params.get(key))
+            columns.update(params.get('states') or {}) # the state columns a metric selects on
+            columns.update(params.get('counters', {}).values())
+        return sorted(columns)
+
+class RecipeBook:
+    '''All recipes and templates of a recipes file'''
+    
+    def __init__(self, config):
+        self.templates = {name: Template(name, **template) for name, template in config['templates'].items()}
+        self.recipes = {site: Recipe(site, recipe['kpis'], self.templates[recipe['template']], recipe.get('values'), recipe.get('aggregation', 'grid'))
+                        for site, recipe in config['sites'].items()}
+    
+    @property
+    def sites(self):
+        return list(self.recipes)
+    
+    def get(self, site):
+        '''Recipe of the site, a site without a recipe gets the default KPIs and no template'''
+        return self.recipes.get(site) or Recipe(site, DEFAULT_KPIS)
+
+_recipe_books = {}
+
+def load_recipes(file_location = None):
+    '''Loads (once per file) the recipes file, by default BaseFiles/recipes.json'''
+    
+    if file_location is None:
+        file_location = os.path.join(BASE_FOLDER, 'recipes.json')
+    
+    if file_location not in _recipe_books:
+        with open(file_location) as file:
+            _recipe_books[file_location] = RecipeBook(json.load(file))
+    
+    return _recipe_books[file_location]
+
+#%% Vectorized building blocks for the analysis
+
+TRIP_CODES = (90, 99) # SEQSTATE codes that mark a trip of the unit
+
+def detect_events(time, state, codes = TRIP_CODES):
+    '''
+    Finds every window in which the state is one of the given codes.
+    
+    The windows follow from the state transitions in one pass (run-length encoding) instead of a row by row loop.
+    A window ends at the first sample that is no longer in one of the codes, a window that is still open at the
+    end of the data is closed at the last timestamp.
+    
+    Returns a frame with the columns Date (start), Duration and endDate, one row per window.
+    '''
+    
+    time = np.asarray(time, dtype = 'datetime64[ns]') # a view, only the start and end times are taken from it
+    active = np.isin(np.asarray(state), codes)
+    
+    changes = np.flatnonzero(active[1:] != active[:-1]) + 1
+    starts = changes[active[changes]]
+    ends = changes[~active[changes]] # first sample after the window
+    if len(active) and active[0]:
+        starts = np.r_[0, starts]
+    if len(active) and active[-1]:
+        ends = np.r_[ends, len(active)-1] # still open, closed at the last sample
+    
+    trip_data = pd.DataFrame({'Date': pd.DatetimeIndex(time[starts]), 'endDate': pd.DatetimeIndex(time[ends])})
+    trip_data.insert(1, 'Duration', trip_data['endDate'] - trip_data['Date'])
+    
+    return trip_data
+
+def sample_hold_durations(time):
+    '''
+    Seconds that every sample holds its value: until the next sample, IXON logs a value when it changes.
+    The last sample holds for 0 s, there is nothing after it to tell how long it lasted.
+    '''
+    
+    nanoseconds = np.asarray(pd.DatetimeIndex(time).asi8)
+    return np.diff(nanoseconds, append = nanoseconds[-1:]) / 1e9 if len(nanoseconds) else np.zeros(0)
+
+def integrate_counters(dataframe, columns, rollover = None, reset_ratio = 0.5, initial = None):
+    '''
+    Integrates monotonic counters (e.g. kWh meters) for several columns in one call, using array differences.
+    
+    Every positive step is counted. A step down is handled as follows:
+        - the counter fell below reset_ratio times its previous value: the counter was reset (or rolled over) and
+          started again from zero, so the new value is counted. With a known rollover value the part up to the
+          rollover is counted as well. rollover is one value for all columns or {column: value} (see the energy
+          KPI of the recipes), columns without one are taken as reset.
+        - a smaller step down is jitter of the meter and adds nothing, like before.
+    A single sample that drops and comes back on the next sample is a dropout and is held at the previous value.
+    initial holds the last counter values of earlier data, the step to the first sample is then counted as well.
+    
+    Returns the total per column (Series) and the energy per day (DataFrame, one row per day).
+    '''
+    
+    time = dataframe['time'] if 'time' in dataframe.columns else dataframe.index
+    values = dataframe[columns].to_numpy(dtype = np.float64, copy = True)
+    
+    if initial is not None:
+        values = np.vstack([np.asarray(initial, dtype = np.float64).reshape(1, -1), values])
+    else:
+        time = time[1:] # the energy of a step is booked at the time of its second sample
+    
+    # Hold single sample dropouts at the previous value
+    dropout = (values[1:-1] < values[:-2]) & (values[2:] >= values[:-2])
+    values[1:-1][dropout] = values[:-2][dropout]
+    
+    previous = values[:-1]
+    current = values[1:]
+    steps = current - previous
+    
+    restart = (steps < 0) & (current < reset_ratio*previous)
+    if isinstance(rollover, dict):
+        rollover = np.array([rollover.get(column, np.nan) for column in columns], dtype = np.float64)
+    if rollover is None:
+        restart_energy = current
+    else:
+        rollover = np.broadcast_to(np.asarray(rollover, dtype = np.float64), current.shape[1:])
+        restart_energy = np.where(np.isnan(rollover), current, current + (rollover - previous))
+    
+    energy = np.where(steps > 0, steps, 0)
+    energy = np.where(restart, restart_energy, energy)
+    
+    totals = pd.Series(energy.sum(axis = 0), index = columns)
+    
+    days = pd.DatetimeIndex(time).normalize()
+    daily = pd.DataFrame(energy, columns = columns).groupby(days).sum()
+    daily.index.name = 'date'
+    
+    return totals, daily
+
+class StateAggregate:
+    '''
+    Sums, counts and means of value columns per combination of state codes, from one grouped pass over the data.
+    
+    The data is grouped once on all state columns together. A KPI then selects the state codes it needs from the
+    small grouped tables, instead of building a boolean mask and a filtered copy of the data for every KPI.
+    
+    A state selection is a dictionary {state column: code or list of codes}, a code of None selects every recorded
+    (non missing) state of that column.
+    
+    Every row stands for a period of time. On the 5 minute grid each row is one period of 1/per_hour hours. With
+    durations (in 1/per_hour hours, per row) the sums and counts are weighted by the duration of each row: the means
+    become time weighted means and the sums integrals over time, e.g. Nm3 from a flow in Nm3/h.
+    '''
+    
+    def __init__(self, states, values, weights = None, durations = None, per_hour = 12):
+        '''
+        states: frame with the state columns, values: frame with the value columns (same index).
+        weights: {column: weight column}, adds the product of both so weighted_mean can be taken from the sums.
+        durations: Series with the duration of every row, None for rows of one period each.
+        '''
+        
+        if weights:
+            products = {column+'*'+weight: values[column]*values[weight] for column, weight in weights.items()}
+            values = pd.concat([values, pd.DataFrame(products, index = values.index, copy = False)], axis = 1, copy = False)
+        
+        groups = [states[column] for column in states.columns]
+        
+        if durations is None:
+            grouped = values.groupby(groups, sort = False, dropna = False)
+            self.sums = grouped.sum()
+            self.counts = grouped.count()
+            self.rows = grouped.size()
+        else:
+            self.sums = values.mul(durations, axis = 0).groupby(groups, sort = False, dropna = False).sum()
+            self.counts = values.notna().mul(durations, axis = 0).groupby(groups, sort = False, dropna = False).sum()
+            self.rows = durations.groupby(groups, sort = False, dropna = False).sum()
+        
+        self.per_hour = per_hour
+    
+    def _mask(self, states):
+        mask = np.ones(len(self.rows), dtype = bool)
+        for column, codes in (states or {}).items():
+            level = self.rows.index.get_level_values(column)
+            if codes is None:
+                mask &= level.notna()
+            else:
+                mask &= level.isin(np.atleast_1d(codes))
+        return mask
+    
+    def hours(self, states = None):
+        '''Hours in the selected states'''
+        return self.rows[self._mask(states)].sum()/self.per_hour
+    
+    def sum(self, column, states = None):
+        return self.sums[column][self._mask(states)].sum()
+    
+    def integral(self, column, states = None):
+        '''Integral over time [value * h] of a column in the selected states, e.g. Nm3 from a flow in Nm3/h'''
+        return self.sum(column, states)/self.per_hour
+    
+    def mean(self, column, states = None):
+        mask = self._mask(states)
+        count = self.counts[column][mask].sum()
+        return self.sums[column][mask].sum()/count if count else np.nan
+    
+    def weighted_mean(self, column, weight, states = None):
+        mask = self._mask(states)
+        total_weight = self.sums[weight][mask].sum()
+        return self.sums[column+'*'+weight][mask].sum()/total_weight if total_weight else np.nan
+    
+    def __add__(self, other):
+        '''Aggregate of the data of both aggregates together, used to fold new data into a running aggregate'''
+        
+        if self.per_hour != other.per_hour:
+            raise ValueError('Aggregates of different periods can not be added')
+        
+        merged = StateAggregate.__new__(StateAggregate)
+        merged.per_hour = self.per_hour
+        for name in ('sums', 'counts', 'rows'):
+            table = pd.concat([getattr(self, name), getattr(other, name)])
+            levels = list(range(table.index.nlevels))
+            setattr(merged, name, table.groupby(level = levels, sort = False, dropna = False).sum())
+        return merged
+    
+    def to_dict(self):
+        '''The tables as plain lists, for storing the aggregate as json'''
+        
+        return {
+            'states': list(self.rows.index.names),
+            'per_hour': self.per_hour,
+            'sums': self.sums.reset_index().to_dict(orient = 'list'),
+            'counts': self.counts.reset_index().to_dict(orient = 'list'),
+            'rows': self.rows.rename('rows').reset_index().to_dict(orient = 'list'),
+            }
+    
+    @classmethod
+    def from_dict(cls, data):
+        
+        aggregate = cls.__new__(cls)
+        aggregate.sums = pd.DataFrame(data['sums']).set_index(data['states'])
+        aggregate.counts = pd.DataFrame(data['counts']).set_index(data['states'])
+        aggregate.rows = pd.DataFrame(data['rows']).set_index(data['states'])['rows']
+        aggregate.per_hour = data.get('per_hour', 12)
+        return aggregate
+
+#%% Data quality
+
+'''
+A quick check of the raw data before the KPIs, the gaps are filled when reading (read_export) and the filled
+values would otherwise go into the running hours and flow totals unnoticed:
+    - gaps in the timestamps: steps longer than GAP_FACTOR times the usual step and at least MIN_GAP_SECONDS
+    - duplicate timestamps
+    - flat lines: analog tags that keep the same value for FLATLINE_HOURS or longer (after the forward fill this
+      is also a tag that was not logged at all)
+    - energy counters: jumps (a rate JUMP_FACTOR times the usual rate), resets and other steps down
+The data is checked in blocks of rows, so the check of a year of 1 s data needs little memory next to the data.
+'''
+
+GAP_FACTOR = 10
+MIN_GAP_SECONDS = 900
+FLATLINE_HOURS = 6
+JUMP_FACTOR = 50
+QUALITY_SAMPLE = 1 << 20 # steps sampled for the usual step and counter rates
+QUALITY_BLOCK = 1 << 20 # rows per block
+
+def data_quality(dataframe, reset_ratio = 0.5, block_size = QUALITY_BLOCK, last_change = None):
+    '''
+    The data quality summary of raw data with a time column, a dictionary of plain values (stored as json).
+    last_change is the last_change of the summary of the data before (ns per analog tag), to continue its flat lines
+    when the data starts with the last row of the data before (see combine_quality).
+    '''
+    
+    df = dataframe
+    time = df['time'].to_numpy().view(np.int64) # ns
+    n = len(time)
+    
+    analog = [column for column in df.columns if column != 'time' and column not in STATE_COLUMNS and not column.startswith('Energy')]
+    counters = [column for column in df.columns if column.startswith('Energy')]
+    
+    iso = lambda ns: pd.Timestamp(int(ns)).isoformat()
+    quality = {
+        'rows': n, 'start': iso(time[0]) if n else None, 'end': iso(time[-1]) if n else None, 'step_seconds': None,
+        'gaps': 0, 'gap_hours': 0.0, 'longest_gap_hours': 0.0, 'longest_gap_start': None, 'duplicates': 0,
+        'flatlines': {column: {'count': 0, 'hours': 0.0, 'longest_hours': 0.0} for column in analog},
+        'counters': {column: {'jumps': 0, 'resets': 0, 'drops': 0} for column in counters},
+        'last_change': {}, # the time of the last change of the analog tags, where the flat line at the end starts
+        }
+    if n:
+        last_change = {column: int((last_change or {}).get(column, time[0])) for column in analog}
+        quality['last_change'] = last_change
+    if n < 2:
+        return quality
+    
+    # The usual step and counter rates from a sample of the steps spread over the data
+    sample = np.arange(0, n-1, max(1, (n-1)//QUALITY_SAMPLE))
+    sample_steps = time[sample+1] - time[sample]
+    step = float(np.median(sample_steps))
+    quality['step_seconds'] = step/1e9
+    gap = max(MIN_GAP_SECONDS*1e9, GAP_FACTOR*step)
+    
+    rates = {}
+    for column in counters:
+        values = df[column].to_numpy()
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            sample_rates = (values[sample+1] - values[sample])/sample_steps
+        positive = sample_rates[(sample_rates > 0) & np.isfinite(sample_rates)]
+        rates[column] = JUMP_FACTOR*np.median(positive) if len(positive) else np.inf
+    
+    flat = FLATLINE_HOURS*3600e9
+    hour = 3600e9
+    
+    def flatlines(column, runs):
+        runs = runs[runs >= flat]
+        if len(runs):
+            summary = quality['flatlines'][column]
+            summary['count'] += len(runs)
+            summary['hours'] += float(runs.sum()/hour)
+            summary['longest_hours'] = max(summary['longest_hours'], float(runs.max()/hour))
+    
+    for first in range(0, n-1, block_size):
+        last = min(first + block_size, n-1) # the steps from the rows first to last
+        t = time[first:last+1]
+        steps = np.diff(t)
+        
+        gaps = np.flatnonzero(steps > gap)
+        if len(gaps):
+            quality['gaps'] += len(gaps)
+            quality['gap_hours'] += float(steps[gaps].sum()/hour)
+            longest = gaps[np.argmax(steps[gaps])]
+            if steps[longest]/hour > quality['longest_gap_hours']:
+                quality['longest_gap_hours'] = float(steps[longest]/hour)
+                quality['longest_gap_start'] = iso(t[longest])
+        quality['duplicates'] += int(np.count_nonzero(steps == 0))
+        
+        for column in analog:
+            values = df[column].to_numpy()[first:last+1]
+            changed = (values[1:] != values[:-1]) & ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+            changes = t[1:][changed]
+            if len(changes):
+                flatlines(column, np.diff(changes, prepend = last_change[column]))
+                last_change[column] = int(changes[-1])
+        
+        for column in counters:
+            values = df[column].to_numpy()[first:last+1].astype(np.float64)
+            previous, current = values[:-1], values[1:]
+            counter_steps = current - previous
+            down = counter_steps < 0
+            resets = down & (current < reset_ratio*previous)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                jumps = (counter_steps > 0) & (steps > 0) & (counter_steps/steps > rates[column]) # a duplicate timestamp is counted above
+            summary = quality['counters'][column]
+            summary['jumps'] += int(np.count_nonzero(jumps))
+            summary['resets'] += int(np.count_nonzero(resets))
+            summary['drops'] += int(np.count_nonzero(down & ~resets))
+    
+    for column in analog: # the value at the end of the data
+        flatlines(column, np.array([time[-1] - last_change[column]]))
+    
+    return quality
+
+def combine_quality(earlier, later):
+    '''
+    The quality summary of two consecutive parts of the data. The later part is checked from the last row of the
+    earlier part with its last_change (without counting that row), so the steps over the boundary are in the later
+    part and a flat line over the boundary is counted once: at the end of the earlier part it is taken out again.
+    '''
+    
+    if earlier is None or not earlier['rows']:
+        return later
+    if not later['rows']:
+        return earlier
+    
+    quality = dict(later, rows = earlier['rows'] + later['rows'], start = earlier['start'],
+                   gaps = earlier['gaps'] + later['gaps'], gap_hours = earlier['gap_hours'] + later['gap_hours'],
+                   duplicates = earlier['duplicates'] + later['duplicates'])
+    quality['step_seconds'] = (earlier if earlier['rows'] > later['rows'] else later)['step_seconds']
+    if earlier['longest_gap_hours'] >= later['longest_gap_hours']:
+        quality['longest_gap_hours'], quality['longest_gap_start'] = earlier['longest_gap_hours'], earlier['longest_gap_start']
+    
+    quality['flatlines'] = {}
+    end = pd.Timestamp(earlier['end']).value
+    for column in set(earlier['flatlines']) | set(later['flatlines']):
+        a, b = [part['flatlines'].get(column, {'count': 0, 'hours': 0.0, 'longest_hours': 0.0}) for part in (earlier, later)]
+        count, hours = a['count'] + b['count'], a['hours'] + b['hours']
+        
+        run = end - earlier.get('last_change', {}).get(column, end) # continued in the later part
+        if run >= FLATLINE_HOURS*3600e9:
+            count, hours = count - 1, hours - run/3600e9
+        quality['flatlines'][column] = {'count': count, 'hours': hours, 'longest_hours': max(a['longest_hours'], b['longest_hours'])}
+    quality['counters'] = {}
+    for column in set(earlier['counters']) | set(later['counters']):
+        a, b = [part['counters'].get(column, {'jumps': 0, 'resets': 0, 'drops': 0}) for part in (earlier, later)]
+        quality['counters'][column] = {key: a[key] + b[key] for key in ('jumps', 'resets', 'drops')}
+    
+    return quality
+
+def quality_rows(quality):
+    '''The quality summary as rows (key, Dutch label, value) for the report, the keys for machine readable output'''
+    
+    rows = [
+        ('rows', 'Aantal regels', quality['rows']),
+        ('start', 'Eerste tijdstip', quality['start']),
+        ('end', 'Laatste tijdstip', quality['end']),
+        ('step_seconds', 'Gebruikelijke stap [s]', quality['step_seconds']),
+        ('gaps', 'Gaten in de tijdreeks', quality['gaps']),
+        ('gap_hours', 'Uren in gaten [h]', round(quality['gap_hours'], 2)),
+        ('longest_gap_hours', 'Langste gat [h]', round(quality['longest_gap_hours'], 2)),
+        ('longest_gap_start', 'Langste gat vanaf', quality['longest_gap_start']),
+        ('duplicates', 'Dubbele tijdstippen', quality['duplicates']),
+        ]
+    for column, flat in sorted(quality['flatlines'].items()):
+        rows.append((f'flatline_hours.{column}', f'Vlakke lijn {column} [h]', round(flat['hours'], 2)))
+        rows.append((f'flatline_longest_hours.{column}', f'Langste vlakke lijn {column} [h]', round(flat['longest_hours'], 2)))
+    for column, counter in sorted(quality['counters'].items()):
+        rows.append((f'counter_jumps.{column}', f'Sprongen {column}', counter['jumps']))
+        rows.append((f'counter_resets.{column}', f'Resets {column}', counter['resets']))
+        rows.append((f'counter_drops.{column}', f'Dalingen {column}', counter['drops']))
+    return rows
+
+#%% Metrics on column arrays
+
+'''
+Side effect free operations on the NumPy arrays of columns, for the derived values that the KPIs aggregate.
+The conditional and (flow) weighted means over state selections are taken by StateAggregate.
+'''
+
+def mask_range(values, low = None, high = None, inclusive = True):
+    '''The values with NaN outside [low, high], with inclusive = False the bounds themselves are masked too'''
+    
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+    
+    valid = ~np.isnan(values)
+    if low is not None:
+        valid &= values >= low if inclusive else values > low
+    if high is not None:
+        valid &= values <= high if inclusive else values < high
+    
+    return np.where(valid, values, values.dtype.type(np.nan))
+
+def interpolate_gaps(values):
+    '''
+    Fills the NaN values by linear interpolation between the valid neighbours (by position, like
+    Series.interpolate(method = 'linear')). Values before the first valid value stay NaN, values after the last valid
+    value get that value.
+    '''
+    
+    values = np.asarray(values, dtype = np.float64)
+    valid = ~np.isnan(values)
+    if valid.all() or not valid.any():
+        return values.copy()
+    
+    positions = np.flatnonzero(valid)
+    filled = np.interp(np.arange(len(values)), positions, values[positions])
+    filled[:positions[0]] = np.nan
+    
+    return filled
+
+class Metric:
+    '''
+    A metric that a recipe declares instead of a KPI method, e.g. the flow weighted H2S in production:
+        {"kpi": "metric", "name": "mean_H2S_treated", "column": "H2S_in", "states": {"SEQSTATE": 62},
+         "weight": "RHA10CF001", "low": 5, "interpolate": true}
+    The values outside [low, high] are masked and, with interpolate, filled in from their neighbours. The KPI is the
+    mean of the values in the selected states, weighted by the weight column when given.
+    '''
+    
+    def __init__(self, name, column, states = None, weight = None, low = None, high = None, inclusive = True, interpolate = False):
+        if not name.isidentifier():
+            raise ValueError(f'Metric name {name!r} is not a valid KPI name')
+        self.name = name
+        self.column = column
+        self.states = states
+        self.weight = weight
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+        self.interpolate = interpolate
+    
+    @property
+    def key(self):
+        '''Value column of the metric in the aggregate'''
+        return 'metric '+self.name
+    
+    def values(self, dataframe):
+        '''The derived values of the column, the column itself when nothing is masked'''
+        
+        values = dataframe[self.column]
+        if self.low is None and self.high is None and not self.interpolate:
+            return values
+        
+        values = mask_range(values.to_numpy(), self.low, self.high, self.inclusive)
+        if self.interpolate:
+            values = interpolate_gaps(values)
+        return pd.Series(values, index = dataframe.index, name = self.key, copy = False)
+    
+    def value(self, aggregate):
+        if self.weight:
+            return aggregate.weighted_mean(self.key, self.weight, self.states)
+        return aggregate.mean(self.key, self.states)
+
+#%% Stage profiler
+
+class StageProfiler:
+    '''
+    Records the wall time, the peak memory and the number of rows of every stage of a report.
+    
+    The peak memory of a stage is what Python and numpy allocated on top of the memory in use at its start
+    (tracemalloc). The resident memory of the process after the stage comes from psutil when it is installed, the
+    highest resident memory so far from the resource module (or psutil on Windows). A stage can also record the
+    size of its resulting frame as frame_mb, see frame_megabytes.
+    Tracing the allocations slows down the stages, with memory = False only the time and the rows are recorded.
+    Tracing starts at the first stage, stop() ends it when the report is done (if this profiler started it).
+    A disabled profiler only runs the stages.
+    
+    The listener, when given, is called with the name of every stage before it starts, also when the profiler is
+    disabled. The GUI uses this to follow the progress of a report and to stop it between stages.
+    '''
+    
+    def __init__(self, enabled = True, memory = True, listener = None):
+        self.enabled = enabled
+        self.memory = memory
+        self.listener = listener
+        self.stages = []
+        self.tracing = False # tracemalloc was started by this profiler
+        
+        try:
+            import psutil
+            self.process = psutil.Process()
+        except ImportError:
+            self.process = None
+    
+    @contextmanager
+    def stage(self, name):
+        '''Context manager around a stage, the stage can set the number of rows in the yielded record'''
+        
+        record = {'stage': name, 'rows': None, 'frame_mb': None}
+        
+        if self.listener is not None:
+            self.listener(name)
+        
+        if not self.enabled:
+            yield record
+            return
+        
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            record['peak_mb'] = round((tracemalloc.get_traced_memory()[1] - memory_start)/1024**2, 2) if self.memory else None
+            record['rss_mb'] = self.resident_memory()
+            record['peak_rss_mb'] = self.peak_resident_memory()
+            self.stages.append(record)
+    
+    def stop(self):
+        '''Stops tracing the allocations when this profiler started it, called when the report is done'''
+        
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+    
+    def resident_memory(self):
+        '''Resident memory of the process in MB, None without psutil'''
+        
+        if self.process is not None:
+            return round(self.process.memory_info().rss/1024**2, 1)
+        return None
+    
+    def peak_resident_memory(self):
+        '''Highest resident memory of the process so far in MB, None when it can not be determined'''
+        
+        try:
+            import resource
+        except ImportError:
+            peak = getattr(self.process.memory_info(), 'peak_wset', None) if self.process is not None else None # Windows
+            return round(peak/1024**2, 1) if peak else None
+        
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1)
+    
+    def write(self, file_name):
+        '''Writes the timing report as <file_name>.timings.json and <file_name>.timings.csv'''
+        
+        with open(file_name+'.timings.json', 'w') as file:
+            json.dump({'version': __version__, 'total_seconds': round(sum(stage['seconds'] for stage in self.stages), 4), 'stages': self.stages}, file, indent = 2)
+        
+        with open(file_name+'.timings.csv', 'w', newline = '') as file:
+            writer = csv.DictWriter(file, fieldnames = ['stage', 'seconds', 'peak_mb', 'rss_mb', 'peak_rss_mb', 'rows', 'frame_mb'])
+            writer.writeheader()
+            writer.writerows(self.stages)
+
+def frame_megabytes(dataframe):
+    '''Memory of the columns and the index of a frame in MB'''
+    return round(dataframe.memory_usage(index = True, deep = True).sum()/1024**2, 1)
+
+class ReportCancelled(Exception):
+    '''Raised between two stages when the report was cancelled'''
+
+#%% Cache of parsed exports
+
+PIPELINE_VERSION = 1 # increase when import_csv, create_error_list or resample_data change, this invalidates the cache
+CACHE_VERSION = 2 # increase when an entry holds more, only the cache is invalidated (not the month to date states)
+
+CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.burp_cache')
+CACHE_SIZE = 2*1024**3 # bytes, least recently used entries are removed above this size
+
+def file_hash(file_location, blocksize = 1024**2):
+    '''Content hash of a file, read in blocks'''
+    
+    digest = hashlib.blake2b(digest_size = 16)
+    with open(file_location, 'rb') as file:
+        for block in iter(lambda: file.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ExportCache:
+    '''
+    On disk cache of parsed exports, the resampled data together with the trip list and the period, and the trips of
+    every state column for the trip index (see trip_events).
+    
+    Entries are keyed by the content hash of the csv, the site and the columns that are read and PIPELINE_VERSION
+    and CACHE_VERSION. The frames are stored as uncompressed Arrow IPC (Feather) files, so they are read back memory
+    mapped instead of being parsed. When the cache grows over max_size the least recently used entries are removed.
+    The cache needs pyarrow, without it nothing is cached.
+    '''
+    
+    def __init__(self, folder = CACHE_FOLDER, max_size = CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        
+        try:
+            from pyarrow import feather
+            self.feather = feather
+        except ImportError:
+            self.feather = None
+    
+    @property
+    def available(self):
+        return self.feather is not None
+    
+    def key(self, file_location, site, columns, aggregation = 'grid'):
+        site_code = site.split(' - ')[0]
+        columns_hash = hashlib.blake2b(repr(columns).encode(), digest_size = 4).hexdigest()
+        return f'{file_hash(file_location)}-{site_code}-{columns_hash}-{aggregation}-v{PIPELINE_VERSION}.{CACHE_VERSION}'
+    
+    def load(self, key):
+        '''Returns (data, trip list, meta data) for the key, or None when the export is not in the cache'''
+        
+        entry = os.path.join(self.folder, key)
+        if not self.available or not os.path.isdir(entry):
+            return None
+        
+        try:
+            with open(os.path.join(entry, 'meta.json')) as file:
+                meta = json.load(file)
+            data = self.feather.read_table(os.path.join(entry, 'data.arrow'), memory_map = True).to_pandas(split_blocks = True)
+            trips = self.feather.read_table(os.path.join(entry, 'trips.arrow'), memory_map = True).to_pandas()
+        except (OSError, ValueError):
+            return None
+        
+        os.utime(os.path.join(entry, 'meta.json')) # marks the entry as recently used
+        
+        return data, trips, meta
+    
+    def load_events(self, key, meta):
+        '''
+        The trips of the state columns of an entry like trip_events, None for an entry that was stored without
+        them (the export has to be parsed again for the trip index)
+        '''
+        
+        events_file = os.path.join(self.folder, key, 'events.arrow')
+        if 'events' not in meta or not os.path.isfile(events_file):
+            return None
+        
+        table = self.feather.read_table(events_file).to_pandas()
+        events = {}
+        for tag, last_open in meta['events'].items():
+            trips = table.loc[table['tag'] == tag, ['Date', 'endDate']].reset_index(drop = True)
+            trips.insert(1, 'Duration', trips['endDate'] - trips['Date'])
+            events[tag] = (trips, last_open)
+        return events
+    
+    def window(self, key, start, end, columns = None):
+        '''
+        The cached data of an export from start to end (inclusive), None when the export is not in the cache.
+        The data file is memory mapped and sliced, only the rows of the window are read and converted. The times
+        are searched chunk by chunk without a copy, so the time column of a year of data is not read as a whole.
+        '''
+        
+        data_file = os.path.join(self.folder, key or '', 'data.arrow')
+        if not self.available or not key or not os.path.isfile(data_file):
+            return None
+        
+        table = self.feather.read_table(data_file, memory_map = True)
+        
+        def position(timestamp, side):
+            '''Row of the timestamp like np.searchsorted, only the chunk that holds it is searched'''
+            
+            offset = 0
+            for chunk in table.column('time').chunks:
+                time = chunk.to_numpy() # a view of the mapped file
+                if len(time) and np.searchsorted(time[-1:], timestamp, side) == 0: # ends after the timestamp
+                    return offset + int(np.searchsorted(time, timestamp, side))
+                offset += len(time)
+            return offset
+        
+        first = position(pd.Timestamp(start).to_datetime64(), 'left')
+        last = position(pd.Timestamp(end).to_datetime64(), 'right')
+        table = table.slice(first, max(0, last - first))
+        
+        if columns is not None:
+            table = table.select([column for column in table.column_names if column == 'time' or column in columns])
+        
+        return table.to_pandas()
+    
+    def store(self, key, data, trips, meta, events = None):
+        '''
+        Writes an entry, the entry becomes visible in one rename so parallel runs never read half an entry.
+        events are the trips of the state columns (trip_events), whether the last trip is open goes in the meta data.
+        '''
+        
+        if not self.available:
+            return
+        
+        entry = os.path.join(self.folder, key)
+        partial = entry + f'.{os.getpid()}.partial'
+        os.makedirs(partial, exist_ok = True)
+        
+        self.feather.write_feather(data, os.path.join(partial, 'data.arrow'), compression = 'uncompressed')
+        self.feather.write_feather(trips, os.path.join(partial, 'trips.arrow'), compression = 'uncompressed')
+        if events is not None:
+            table = pd.concat([trips[['Date', 'endDate']].assign(tag = tag) for tag, (trips, last_open) in events.items()], ignore_index = True) \
+                if events else pd.DataFrame({'Date': [], 'endDate': [], 'tag': []}).astype({'Date': 'datetime64[ns]', 'endDate': 'datetime64[ns]', 'tag': str})
+            self.feather.write_feather(table, os.path.join(partial, 'events.arrow'), compression = 'uncompressed')
+            meta = dict(meta, events = {tag: last_open for tag, (trips, last_open) in events.items()})
+        with open(os.path.join(partial, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+        
+        try:
+            os.rename(partial, entry)
+        except OSError:
+            shutil.rmtree(partial, ignore_errors = True) # another run stored the same export first
+        
+        self.evict()
+    
+    def evict(self):
+        '''Removes the least recently used entries until the cache fits in max_size'''
+        
+        entries = []
+        for name in os.listdir(self.folder):
+            entry = os.path.join(self.folder, name)
+            meta = os.path.join(entry, 'meta.json')
+            if not os.path.isfile(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+            entries.append((os.path.getmtime(meta), size, entry))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors = True)
+            total -= size
 
-import pandas as pd
-import numpy as np
+#%% Trip event index
+
+'''
+The trips of every site are kept in an index on disk, across months and exports, so they can be looked up without
+reading the exports again: the trips in a period, the longest trips, the trips of the main unit that overlap trips
+of the CO2 liquefaction. The index of a site is a NumPy file of records (start, end, state column, open, source)
+sorted by state column and start, it is memory mapped for the queries. The source is the key of the export in the
+export cache, from there the data around a trip is taken for a closer look (the 5 minute grid, or the raw samples
+with time weighting).
+A report adds the trips of the export it parses, the trips in the period of the export replace the earlier ones.
+'''
+
+TRIP_INDEX_FOLDER = os.path.join(os.path.expanduser('~'), '.burp_trips')
+
+TRIP_INDEX_CODES = {
+    # state column: codes of a trip, as in the KPIs (calculate_operating_hours, calculate_availability)
+    'SEQSTATE': TRIP_CODES,
+    'SEQSTATE_CO2': TRIP_CODES,
+    'CO2LIQ': (5,),
+    'Heatpump': (5,),
+    }
+
+def trip_record():
+    '''dtype of the records of the trip index (a function, numpy is imported on first use)'''
+    return np.dtype([('start', 'M8[ns]'), ('end', 'M8[ns]'), ('tag', 'U16'), ('open', '?'), ('source', 'U80')])
+
+def trip_events(dataframe):
+    '''
+    The trips of every state column of TRIP_INDEX_CODES in the data (raw data with a time column),
+    {state column: (frame of detect_events, the last trip is still open at the end of the data)}
+    '''
+    
+    df = dataframe
+    events = {}
+    for tag, codes in TRIP_INDEX_CODES.items():
+        if tag in df.columns:
+            state = df[tag].to_numpy()
+            events[tag] = (detect_events(df['time'], state, codes), bool(len(state)) and bool(np.isin(state[-1], codes)))
+    return events
+
+@contextmanager
+def file_lock(file_location, timeout = 60):
+    '''Lock for a read, change and write of a file by parallel runs, a lock older than timeout is taken over'''
+    
+    lock = file_location+'.lock'
+    deadline = time.time() + timeout
+    while True:
+        try:
+            handle = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.time() > deadline: # left behind by a run that was killed
+                os.remove(lock)
+                deadline = time.time() + timeout
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(handle)
+        os.remove(lock)
+
+class TripIndex:
+    '''The trip event index of the sites, see above. Queries return frames with Date, Duration and endDate like the trip lists.'''
+    
+    def __init__(self, folder = TRIP_INDEX_FOLDER):
+        self.folder = folder
+    
+    def file(self, site):
+        return os.path.join(self.folder, site.split(' - ')[0]+'.trips.npy')
+    
+    def records(self, site, mmap = True):
+        '''All records of the site, memory mapped'''
+        
+        file_location = self.file(site)
+        if not os.path.isfile(file_location):
+            return np.empty(0, dtype = trip_record())
+        return np.load(file_location, mmap_mode = 'r' if mmap else None)
+    
+    def update(self, site, events, start, end, source = None):
+        '''
+        Adds the trips of an export, events as returned by trip_events, start and end are the first and last time
+        of the export. The trips of a state column that start in this period are replaced.
+        A trip that was still open at the end of the earlier data, or that runs on into this period (an export that
+        is indexed again), continues in a trip at the start of the new data or ended there. In the same way a trip of
+        a later export that starts in this period continues the trip that is open at the end of the new data, so
+        indexing an export again keeps the trips that run on into the next export whole.
+        '''
+        
+        os.makedirs(self.folder, exist_ok = True)
+        file_location = self.file(site)
+        start, end = pd.Timestamp(start).to_datetime64(), pd.Timestamp(end).to_datetime64()
+        
+        with file_lock(file_location):
+            records = self.records(site, mmap = False)
+            in_period = np.isin(records['tag'], list(events)) & (records['start'] >= start) & (records['start'] <= end)
+            later = in_period & (records['end'] > end) # runs on into a later export, its part after this period is kept
+            records['start'][later] = end
+            records = records[~in_period | later]
+            
+            new = []
+            merged = np.zeros(len(records), dtype = bool)
+            for tag, (trips, last_open) in events.items():
+                added = np.empty(len(trips), dtype = trip_record())
+                added['start'] = trips['Date'].to_numpy()
+                added['end'] = trips['endDate'].to_numpy()
+                added['tag'] = tag
+                added['open'] = False
+                added['source'] = source or ''
+                if len(added) and last_open:
+                    added['open'][-1] = True
+                
+                # A trip of the earlier data that was open at its end or that runs on into this period
+                earlier = (records['tag'] == tag) & (records['start'] < start) & ((records['open'] & (records['end'] <= start)) | (records['end'] >= start))
+                for position in np.flatnonzero(earlier & ~merged):
+                    if len(added) and added['start'][0] == start: # it continues in the first new trip
+                        added['start'][0] = records['start'][position]
+                        merged[position] = True
+                    else: # it ended at the first new sample
+                        records['end'][position] = start
+                        records['open'][position] = False
+                
+                # A trip of a later export that continues the trip that is open at the end of this data
+                if len(added) and last_open:
+                    for position in np.flatnonzero((records['tag'] == tag) & (records['start'] == end) & ~merged):
+                        added['end'][-1], added['open'][-1] = records['end'][position], records['open'][position]
+                        merged[position] = True
+                new.append(added)
+            
+            records = records[~merged]
+            records = np.concatenate([records] + new)
+            records = records[np.lexsort((records['start'], records['tag']))]
+            
+            with open(file_location+'.partial', 'wb') as file:
+                np.save(file, records)
+            os.replace(file_location+'.partial', file_location)
+    
+    def tag_records(self, records, tag):
+        '''The records of one state column, a view, sorted by start'''
+        first = np.searchsorted(records['tag'], tag, side = 'left')
+        last = np.searchsorted(records['tag'], tag, side = 'right')
+        return records[first:last]
+    
+    def frame(self, records):
+        trips = pd.DataFrame({'Date': records['start'], 'endDate': records['end'], 'tag': records['tag'],
+                              'open': records['open'], 'source': records['source']})
+        trips.insert(1, 'Duration', trips['endDate'] - trips['Date'])
+        return trips
+    
+    def tags(self, records, tags):
+        return list(np.unique(records['tag'])) if tags is None else list(np.atleast_1d(tags))
+    
+    def trips(self, site, start = None, end = None, tags = None):
+        '''Trips that overlap the period from start to end, of the given state columns (all by default)'''
+        
+        records = self.records(site)
+        start = np.datetime64('NaT') if start is None else pd.Timestamp(start).to_datetime64()
+        end = np.datetime64('NaT') if end is None else pd.Timestamp(end).to_datetime64()
+        
+        found = []
+        for tag in self.tags(records, tags):
+            selected = self.tag_records(records, tag)
+            first = 0 if np.isnat(start) else np.searchsorted(np.maximum.accumulate(selected['end']), start, side = 'right')
+            last = len(selected) if np.isnat(end) else np.searchsorted(selected['start'], end, side = 'left')
+            selected = selected[first:last]
+            if not np.isnat(start):
+                selected = selected[selected['end'] > start]
+            found.append(selected)
+        
+        records = np.concatenate(found) if found else records[:0]
+        return self.frame(records[np.argsort(records['start'], kind = 'stable')])
+    
+    def longest(self, site, count = 10, tags = None):
+        '''The count longest trips of the given state columns'''
+        
+        records = self.records(site)
+        records = records[np.isin(records['tag'], self.tags(records, tags))]
+        order = np.argsort(records['start'] - records['end'], kind = 'stable')[:count]
+        return self.frame(records[order])
+    
+    def overlaps(self, site, tag = 'SEQSTATE', other = 'SEQSTATE_CO2'):
+        '''
+        Pairs of trips of two state columns that overlap in time, e.g. trips of the main unit during a trip of the
+        CO2 liquefaction, with the period they overlap (Date, Duration, endDate).
+        '''
+        
+        records = self.records(site)
+        a, b = self.tag_records(records, tag), self.tag_records(records, other)
+        
+        # For every trip of a the trips of b that start before it ends and may end after it starts
+        first = np.searchsorted(np.maximum.accumulate(b['end']), a['start'], side = 'right')
+        last = np.searchsorted(b['start'], a['end'], side = 'left')
+        counts = np.maximum(last - first, 0)
+        
+        index_a = np.repeat(np.arange(len(a)), counts)
+        index_b = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+        overlapping = b['end'][index_b] > a['start'][index_a]
+        index_a, index_b = index_a[overlapping], index_b[overlapping]
+        
+        pairs = pd.DataFrame({'Date': np.maximum(a['start'][index_a], b['start'][index_b]),
+                              'endDate': np.minimum(a['end'][index_a], b['end'][index_b]),
+                              tag+' start': a['start'][index_a], tag+' end': a['end'][index_a],
+                              other+' start': b['start'][index_b], other+' end': b['end'][index_b]})
+        pairs.insert(1, 'Duration', pairs['endDate'] - pairs['Date'])
+        return pairs
+    
+    def context(self, trip, before = '1h', after = '1h', columns = None, cache = None):
+        '''
+        The data around a trip (a row of the frames above) from the export cache, before and after are the time
+        before its start and after its end. None when the export of the trip is not (or no longer) in the cache.
+        '''
+        
+        cache = ExportCache() if cache is None else cache
+        return cache.window(trip['source'], trip['Date'] - pd.Timedelta(before), trip['endDate'] + pd.Timedelta(after), columns)
 
 #%% This is where the programm starts
 
@@ -47,6 +1331,18 @@ class MonthlyReportingTool(tk.Tk):
         self.site_var = tk.StringVar()
         self.file_location_var = tk.StringVar(value = '')
         self.folder_location_var = tk.StringVar(value = '')
+        self.profile_var = tk.BooleanVar(value = False)
+        self.trip_index_var = tk.BooleanVar(value = False)
+        self.status_var = tk.StringVar(value = '')
+        
+        '''
+        Reports are created one after the other on a worker thread, so the window keeps responding and more reports
+        can be queued. The worker reports its progress through a queue that the main loop polls.
+        '''
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        self.progress = queue.Queue()
+        self.jobs = {} # job number: (description, cancel event)
+        self.job_count = 0
         
         '''Start button is created glabally to allow for updating of state, initial state is disabeld'''
         self.start_button = ttk.Button(self, text='Start Reporting', command=self.start_reporting)
@@ -56,6 +1352,12 @@ class MonthlyReportingTool(tk.Tk):
         
         '''Check initial state of the start reporting button'''
         self.update_start_button_state()
+        
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.after(100, self.poll_progress)
+        
+        '''Loads pandas, numpy and openpyxl on the worker once the window is shown, reports queue up behind it'''
+        self.after(200, lambda: self.executor.submit(warm_up))
     
     '''Methods of the reporting class are declared here'''
         
@@ -68,15 +1370,7 @@ class MonthlyReportingTool(tk.Tk):
         label_site.grid(row = 1, column = 1, padx = 5, pady = 25)
         
         site_select = ttk.Combobox(self, width=30, textvariable=self.site_var)
-        site_select['values'] = (
-            'B0175 - Aquafin NV',
-            'B0218 - Delfland Harnaschpolder',
-            'B0565 - Delfland Houtrust',
-            'B0933 - Dommel',
-            'H4187 - Twence',
-            'H4242 - Delfland De Groote Lucht',
-            'PR000041 - Dieckmann'
-            )
+        site_select['values'] = tuple(load_recipes().sites)
         site_select['state'] = 'readonly'
         site_select.current()
         site_select.grid(row = 1, column = 2, padx = 5, pady = 25)
@@ -101,10 +1395,28 @@ class MonthlyReportingTool(tk.Tk):
         reset_button = ttk.Button(self, text="Reset", command=self.reset)
         reset_button.grid(row=4, column=2, pady=25)
         
-        '''stops the program'''
-        cancel_button = ttk.Button(self, text="Cancel", command=self.destroy)
+        '''Cancels the reports that are running or queued, closes the program when there are none'''
+        cancel_button = ttk.Button(self, text="Cancel", command=self.cancel)
         cancel_button.grid(row=4, column=3, padx = 25, pady=25)
         
+        '''Writes a timing report of the stages next to the report'''
+        profile_check = ttk.Checkbutton(self, text="Profile stages", variable=self.profile_var)
+        profile_check.grid(row=5, column=1, padx = 5, pady=(0, 25))
+        
+        '''Adds the trips of the export to the trip index (see TripIndex)'''
+        trip_index_check = ttk.Checkbutton(self, text="Update trip index", variable=self.trip_index_var)
+        trip_index_check.grid(row=5, column=2, padx = 5, pady=(0, 25))
+        
+        '''Shows the queued reports and the stage of the running one'''
+        self.job_list = tk.Listbox(self, width=80, height=5)
+        self.job_list.grid(row=6, column=1, columnspan=3, padx = 5)
+        
+        self.progress_bar = ttk.Progressbar(self, mode='indeterminate', length=400)
+        self.progress_bar.grid(row=7, column=1, columnspan=3, padx = 5, pady=(10, 0))
+        
+        show_status = ttk.Label(self, textvariable=self.status_var, font=("Calibri", 10))
+        show_status.grid(row=8, column=1, columnspan=3, padx = 5, pady=(5, 25))
+        
         '''Updates the state of variables to enable start button'''
         self.site_var.trace("w", lambda *args: self.update_start_button_state())
         self.file_location_var.trace("w", lambda *args: self.update_start_button_state())
@@ -143,13 +1455,101 @@ class MonthlyReportingTool(tk.Tk):
     '''
     
     def start_reporting(self):
-        '''Here we initialize the process of reporting'''
+        '''Here we initialize the process of reporting, the report is queued on the worker thread'''
         
-        report_generator = StandardizedReport(self.site_var.get(), self.file_location_var.get(), self.folder_location_var.get())
+        self.job_count += 1
+        job = self.job_count
+        cancel = threading.Event()
         
-        report_export = ExportToExcel(report_generator)
-
-        pass
+        description = self.site_var.get()+' - '+os.path.basename(self.file_location_var.get())
+        self.jobs[job] = (description, cancel)
+        self.job_list.insert(tk.END, f'{job}. {description}: queued')
+        
+        self.executor.submit(self.create_report, job, cancel, self.site_var.get(), self.file_location_var.get(),
+                             self.folder_location_var.get(), self.profile_var.get(), self.trip_index_var.get())
+    
+    def create_report(self, job, cancel, site, file_location, folder_location, profile, trip_index = False):
+        '''
+        Creates one report, this runs on the worker thread. The outcome is put on the progress queue, the worker
+        never touches the widgets itself.
+        '''
+        
+        def listener(stage):
+            if cancel.is_set():
+                raise ReportCancelled(stage)
+            self.progress.put((job, 'stage', stage))
+        
+        profiler = StageProfiler(enabled = profile, listener = listener)
+        
+        try:
+            listener('start')
+            
+            report_generator = StandardizedReport(site, file_location, folder_location, profiler = profiler,
+                                                  trip_index = TripIndex() if trip_index else None)
+            
+            report_export = ExportToExcel(report_generator, interactive = False)
+            
+            self.progress.put((job, 'done', 'Report for '+report_generator.period+' '+site+' was created'))
+        except ReportCancelled:
+            self.progress.put((job, 'cancelled', None))
+        except Exception as error:
+            self.progress.put((job, 'failed', f'{type(error).__name__}: {error}'))
+        finally:
+            profiler.stop()
+    
+    def poll_progress(self):
+        '''Shows the progress of the worker, called from the main loop every 100 ms'''
+        
+        while True:
+            try:
+                job, event, detail = self.progress.get_nowait()
+            except queue.Empty:
+                break
+            
+            description = self.jobs[job][0]
+            
+            if event == 'stage':
+                self.set_job_status(job, detail)
+                self.status_var.set(f'{description}: {detail}')
+                self.progress_bar.start(10)
+                continue
+            
+            del self.jobs[job]
+            self.set_job_status(job, event)
+            self.status_var.set(f'{description}: {event}')
+            if not self.jobs:
+                self.progress_bar.stop()
+            
+            if event == 'done':
+                messagebox.showinfo('Information', detail)
+            elif event == 'failed':
+                messagebox.showerror('Report failure', detail)
+        
+        self.after(100, self.poll_progress)
+    
+    def set_job_status(self, job, status):
+        for index, line in enumerate(self.job_list.get(0, tk.END)):
+            if line.startswith(f'{job}. '):
+                self.job_list.delete(index)
+                self.job_list.insert(index, line.rsplit(': ', 1)[0]+': '+status)
+                break
+    
+    def cancel(self):
+        '''Cancels the running and queued reports at the next stage, without reports the program is closed'''
+        
+        if not self.jobs:
+            self.close()
+            return
+        
+        for description, cancel in self.jobs.values():
+            cancel.set()
+        self.status_var.set('Cancelling...')
+    
+    def close(self):
+        for description, cancel in self.jobs.values():
+            cancel.set()
+        self.executor.shutdown(wait = False, cancel_futures = True)
+        self.destroy()
 
 class StandardizedReport:
     '''
@@ -158,431 +1558,1617 @@ class StandardizedReport:
     Elements of these receipes are defined below.
     '''
     
-    def __init__(self, site, file_location, folder_location):
+    def __init__(self, site, file_location, folder_location, cache = None, recipes = None, profiler = None, aggregation = None, trip_index = None):
         self.site = site
         self.file_location = file_location
         self.folder_location = folder_location
+        self.recipe = load_recipes(recipes).get(site)
+        self.aggregation = aggregation or self.recipe.aggregation
+        if self.aggregation not in AGGREGATIONS:
+            raise ValueError(f'Unknown aggregation {self.aggregation!r}')
+        self.profiler = StageProfiler(enabled = False) if profiler is None else profiler
+        self.trip_index = trip_index # a TripIndex to add the trips to, None leaves the index alone
         
         ''' The following elements are general across al reports'''
-        self.monthly_report_database = self.import_csv()
+        self.load_data(ExportCache() if cache is None else cache)
+        
+        with self.profiler.stage('aggregate_states') as stage:
+            self.aggregate = self.aggregate_states(self.monthly_report_database)
+            stage['rows'] = len(self.monthly_report_database)
+        
+        ''' The recipe of the site decides which KPIs are calculated'''
+        self.calculate_kpis(self.recipe)
+        
+        
+        
+    def load_data(self, cache):
+        '''
+        Imports the csv, lists the trips (and adds them to the trip index) and resamples the data.
+        A re-run on the same export takes all of this from the cache, pass cache = False to always parse the csv.
+        '''
+        
+        with self.profiler.stage('load_cache') as stage:
+            key = cache.key(self.file_location, self.site, self.recipe.columns, self.aggregation) if cache and cache.available else None
+            cached = cache.load(key) if key else None
+            events = cache.load_events(key, cached[2]) if cached is not None and self.trip_index else None
+            if self.trip_index and events is None:
+                cached = None # stored without the trips of the state columns, parsed again for the trip index
+            stage['rows'] = len(cached[0]) if cached is not None else None
+        
+        if cached is not None:
+            self.monthly_report_database, self.error_list, meta = cached
+            self.period = meta['period']
+            self.save_period = meta['save_period']
+            self.quality = meta['quality']
+            if self.trip_index:
+                with self.profiler.stage('index_trips'):
+                    self.trip_index.update(self.site, events, meta['start'], meta['end'], source = key)
+            return
+        
+        with self.profiler.stage('import_csv') as stage:
+            self.monthly_report_database = self.import_csv()
+            stage['rows'] = len(self.monthly_report_database)
+            stage['frame_mb'] = frame_megabytes(self.monthly_report_database)
+        
+        with self.profiler.stage('data_quality') as stage:
+            self.quality = self.check_quality(self.monthly_report_database)
+            stage['rows'] = len(self.monthly_report_database)
+        
+        with self.profiler.stage('create_error_list') as stage:
+            self.error_list = self.create_error_list(self.monthly_report_database, 'SEQSTATE')
+            stage['rows'] = len(self.error_list)
+        
+        time = self.monthly_report_database['time']
+        if (self.trip_index or key) and len(time): # the trips of all state columns, also kept in the cache
+            with self.profiler.stage('trip_events'):
+                events = trip_events(self.monthly_report_database)
+                start, end = time.iloc[0], time.iloc[-1]
+            
+            if self.trip_index:
+                with self.profiler.stage('index_trips'):
+                    self.trip_index.update(self.site, events, start, end, source = key)
+        
+        if self.aggregation == 'grid':
+            with self.profiler.stage('resample_data') as stage:
+                self.monthly_report_database = self.resample_data(self.monthly_report_database)
+                stage['rows'] = len(self.monthly_report_database)
+                stage['frame_mb'] = frame_megabytes(self.monthly_report_database)
+        
+        if key:
+            with self.profiler.stage('store_cache'):
+                meta = {'site': self.site, 'source': os.path.abspath(self.file_location), 'period': self.period, 'save_period': self.save_period, 'quality': self.quality,
+                        'start': start.isoformat(), 'end': end.isoformat()}
+                cache.store(key, self.monthly_report_database, self.error_list, meta, events)
+    
+    def import_csv(self):
+        '''
+        First import the csv with the data.
+        The export is streamed in chunks with the column/dtype schema of the site, see read_export.
+        '''
+        
+        df = read_export(self.file_location, self.recipe.columns)
+        
+        # Some time data for saving purposes, from the first timestamp (formatting the whole column is slow)
+        self.period = df['time'].iloc[0].strftime('%B-%Y')
+        self.save_period = df['time'].iloc[0].strftime('%Y-%m')
+        
+        return df
+    
+    def check_quality(self, dataframe):
+        '''Gaps, duplicate timestamps, flat lines and counter jumps in the raw data, see data_quality'''
+        return data_quality(dataframe)
+    
+    def create_error_list(self, dataframe, tag, codes = TRIP_CODES):
+        '''
+        Lists every trip window of a state column with its start, duration and end.
+        Works on the raw data (time column) as well as on resampled data (time index).
+        '''
+        
+        df = dataframe
+        time = df['time'] if 'time' in df.columns else df.index
+        
+        trip_data = detect_events(time, df[tag], codes)
+        
+        return trip_data
+    
+    def resample_data(self, dataframe):
+        '''
+        The data on a 5 minute grid, every period takes the first sample at or after its start (a backward fill).
+        The samples are found with a binary search on the time column, only the rows on the grid are copied.
+        '''
+        
+        df = dataframe
+        
+        if df.empty:
+            return df.set_index('time')
+        
+        time = df['time']
+        grid = pd.date_range(time.iloc[0].floor('300s'), time.iloc[-1].floor('300s'), freq = '300s', name = 'time')
+        positions = np.searchsorted(time.to_numpy(), grid.to_numpy(), side = 'left')
+        
+        df = df.iloc[positions].drop(columns = 'time').set_axis(grid)
+        
+        return df
+    
+    def aggregate_states(self, dataframe):
+        '''
+        Groups the data once on all its state columns, the KPIs below are taken from this aggregate.
+        Derived values (the methane in the biogas above 25%, the capacity, the declared metrics) are added as value
+        columns first, only the columns that were read for the recipe are aggregated.
+        '''
+        
+        df = dataframe
+        
+        values = {} # the measured columns are used as they are, without a copy
+        
+        for column in ('RHA10CF001', 'NormalFlow', 'RHH10_CH4', 'Methane_slip'):
+            if column in df.columns:
+                values[column] = df[column]
+        if 'RHH15_CH4' in df.columns:
+            values['RHH15_CH4>25'] = mask_range(df['RHH15_CH4'].to_numpy(), low = 25, inclusive = False)
+        if 'RHM50AN001' in df.columns:
+            values['capacity'] = 50+(df['RHM50AN001']/2)-(df['RHM50AA106']/2)
+        if 'Methane_slip_factor' in df.columns:
+            values['Methane_slip*factor'] = df['Methane_slip']*(df['Methane_slip_factor']/100)
+        
+        weights = {}
+        if 'H2S_in' in df.columns:
+            values['H2S_in'] = self.calculate_H2S_correction_Dommel(df)
+            weights['H2S_in'] = 'RHA10CF001' # flow weighted
+        
+        for metric in self.recipe.metrics:
+            values[metric.key] = metric.values(df)
+            if metric.weight:
+                values.setdefault(metric.weight, df[metric.weight])
+                weights[metric.key] = metric.weight
+        
+        values = pd.DataFrame(values, index = df.index, copy = False)
+        
+        state_columns = [column for column in STATE_COLUMNS if column in df.columns]
+        
+        if self.aggregation == 'time':
+            # The raw samples weighted by the seconds they hold, there is no resampled grid
+            durations = pd.Series(sample_hold_durations(df['time']), index = df.index)
+            return StateAggregate(df[state_columns], values, weights, durations, per_hour = 3600)
+        
+        return StateAggregate(df[state_columns], values, weights)
+    
+    def calculate_kpis(self, recipe):
+        '''
+        Calculates the KPIs of the recipe in order, then sets the fixed values of the recipe.
+        The names of the attributes that were set are kept in kpi_names, for the exports of the numbers.
+        '''
         
-        self.error_list = self.create_error_list(self.monthly_report_database, 'SEQSTATE')
+        before = set(vars(self))
         
-        self.monthly_report_database = self.resample_data(self.monthly_report_database)
+        for name, params in recipe.kpis:
+            with self.profiler.stage('kpi '+name):
+                getattr(self, KPIS[name][0])(**params)
         
-        self.calculate_basic_data(self.monthly_report_database)
+        for name, value in recipe.values.items():
+            setattr(self, name, value)
         
-        self.installation_specific_data(self.monthly_report_database)
+        self.kpi_names = [name for name in vars(self) if name not in before]
+    
+    '''The KPIs that a recipe can ask for, see KPIS'''
+    
+    def calculate_biogas(self):
+        
+        agg = self.aggregate
+        production = {'SEQSTATE': 62}
+        
+        self.biogas = agg.integral('RHA10CF001', production) # biogas flow in production over time [Nm3]
+        self.biogas_CH4 = agg.mean('RHH15_CH4>25', production) # from 5 minute data, average of biogas methane [%]
+    
+    def calculate_biomethane(self):
+        
+        agg = self.aggregate
+        production = {'SEQSTATE': 62}
+        
+        self.biomethane = agg.integral('NormalFlow', production) # biomethane flow in production over time [Nm3]
+        self.biomethane_CH4 = agg.mean('RHH10_CH4', production) # from 5 minute data, average of biomethane methane [%]
+    
+    def calculate_capacity(self):
+        self.capacity = self.aggregate.mean('capacity', {'SEQSTATE': 62})
+    
+    def calculate_methane_slip_estimate(self):
+        '''Needs the biogas and biomethane KPIs'''
+        self.methane_slip = 100*(1-(self.biomethane*self.biomethane_CH4/self.biogas/self.biogas_CH4)) # Guestimate for slip, must be measured [%]
+    
+    def calculate_operating_hours(self):
         
+        agg = self.aggregate
         
+        ''''Availability hours'''
+
+        self.trip = math.floor(agg.hours({'SEQSTATE': [90, 99]}))
+        self.standby = math.floor(agg.hours({'SEQSTATE': 1}))
+        self.running = math.ceil(agg.hours({'SEQSTATE': None})-self.trip-self.standby)
+    
+    def calculate_unit_availability(self, column, name, normal = True):
+        '''Availability hours of a unit (CO2 liquefaction, heat pump) as trip_<name>, standby_<name> and running_<name>'''
         
+        hours = self.calculate_availability(self.aggregate, column, normal)
+        for prefix, value in zip(('trip_', 'standby_', 'running_'), hours):
+            setattr(self, prefix+name, value)
+    
+    def calculate_energies(self, counters, rollover = None):
+        '''
+        counters: {KPI name: counter column}, all counters are integrated in one call.
+        rollover: {counter column: value at which the counter rolls over to zero}, see integrate_counters.
+        '''
+        
+        energy = self.calculate_energy(self.monthly_report_database, list(counters.values()), rollover)
+        for name, column in counters.items():
+            setattr(self, name, float(energy[column]))
+    
+    def calculate_methane_slip_measured(self):
+        
+        agg = self.aggregate
+        
+        self.methane_slip = (agg.mean('Methane_slip', {'SEQSTATE': 62, 'SEQSTATE_CO2': [1,2,90,99]})/100) * \
+            (agg.mean('RHH15_CH4>25', {'SEQSTATE': 62})/100) * \
+            (101325*16.04/8.314/273.15)
+    
+    def calculate_methane_slip_CO2LIQ_active(self):
+        self.methane_slip_CO2LIQ_active = self.aggregate.mean('Methane_slip*factor', {'SEQSTATE': 62, 'SEQSTATE_CO2': 20})
+    
+    def calculate_H2S_treated(self):
+        self.mean_H2S_treated = self.aggregate.weighted_mean('H2S_in', 'RHA10CF001', {'SEQSTATE': 62}) # biogas flow weighted H2S in production [ppm]
+    
+    def calculate_metric(self, name, **declaration):
+        '''A metric declared in the recipe, its values are in the aggregate'''
+        setattr(self, name, Metric(name, **declaration).value(self.aggregate))
+    
+    def calculate_trips_CO2LIQ(self):
+        self.error_list_CO2 = self.create_error_list(self.monthly_report_database, 'SEQSTATE_CO2')
+    
+    '''Calculations used by the KPIs'''
+            
+    def calculate_availability(self, aggregate, column_name, normal = True):
+        
+        agg = aggregate
+        
+        '''Availability hours'''
+        
+        if normal == True:
+            trip = math.floor(agg.hours({column_name: 5}))
+            standby = math.floor(agg.hours({column_name: 1}))
+            running = math.ceil(agg.hours({column_name: None})-trip-standby)
+        else:
+            trip = math.floor(agg.hours({column_name: [90, 99, 1]}))
+            standby = math.floor(agg.hours({column_name: 2}))
+            running = math.ceil(agg.hours({column_name: None})-trip-standby)
+        
+        return trip, standby, running
+
+    def calculate_energy(self, dataframe, column_names, rollover = None):
+        '''
+        Energy [kWh] from the counter columns, all columns are integrated in one call.
+        Returns a number for a single column name and a Series for a list of columns.
+        The energy per day is kept in self.daily_energy.
+        '''
+        
+        df = dataframe
+        
+        columns = [column_names] if isinstance(column_names, str) else list(column_names)
+        
+        totals, self.daily_energy = integrate_counters(df, columns, rollover)
+        
+        if isinstance(column_names, str):
+            return float(totals[column_names])
+        return totals
+    
+    def calculate_H2S_correction_Dommel(self,dataframe):
+        '''
+        H2S values below 5 ppm are not valid measurements, these are interpolated.
+        Returns the corrected H2S, the data itself is not changed. The flow weighted mean is taken in the aggregate.
+        '''
+        df = dataframe
+        
+        H2S = interpolate_gaps(mask_range(df['H2S_in'].to_numpy(), low = 5))
+        
+        return pd.Series(H2S, index = df.index, name = 'H2S_in', copy = False)
+
+
+#%% Month to date reports
+
+class MonthToDateReport(StandardizedReport):
+    '''
+    Month to date report that is updated incrementally, e.g. every day.
+    
+    The running state of the KPIs is kept in a json file in the output folder: the aggregate of the resampled data
+    (sums, counts and weighted sums per state), the last value and the totals of the energy counters, the trips so
+    far with a trip that is still open, and the last row of the data to continue the forward fill.
+    A run only processes the rows after the last processed time, so the export can hold the month so far or only
+    the new rows. A run stops at the end of the month of its state, the next run starts the new month.
+    The end of the export (byte offset and a hash of the last line) is kept too: when the export has only grown
+    since, the next run starts reading there instead of parsing the rows of earlier runs again.
+    '''
+    
+    def __init__(self, site, file_location, folder_location, recipes = None, profiler = None, aggregation = None, trip_index = None):
+        self.state_file = os.path.join(folder_location, site+' - month to date.json')
+        self.state = self.load_state()
+        self.trip_state = {}
+        self.counter_state = {}
+        
+        super().__init__(site, file_location, folder_location, cache = False, recipes = recipes, profiler = profiler, aggregation = aggregation, trip_index = trip_index)
+        
+        with self.profiler.stage('save_state'):
+            self.save_state()
+    
+    def load_state(self):
+        if not os.path.isfile(self.state_file):
+            return None
+        with open(self.state_file) as file:
+            state = json.load(file)
+        return state if state.get('pipeline_version') == PIPELINE_VERSION else None
+    
+    def save_state(self):
+        '''Writes the running state, via a temporary file so an interrupted run keeps the previous state'''
+        
+        df = self.monthly_report_database
+        
+        state = {
+            'pipeline_version': PIPELINE_VERSION,
+            'site': self.site,
+            'period': self.period,
+            'save_period': self.save_period,
+            'aggregation': self.aggregation,
+            'last_row': {name: value.isoformat() if name == 'time' else float(value) for name, value in self.last_row.items()},
+            'last_bin': df.index[-1].isoformat() if self.aggregation == 'grid' and len(df) else (self.state or {}).get('last_bin'),
+            'aggregate': self.aggregate.to_dict(),
+            'counters': self.counter_state,
+            'daily_energy': self.daily_energy.reset_index().astype({'date': str}).to_dict(orient = 'list') if hasattr(self, 'daily_energy') else None,
+            'trips': self.trip_state,
+            'quality': self.quality,
+            'source': self.source,
+            }
+        
+        with open(self.state_file+'.partial', 'w') as file:
+            json.dump(state, file, default = lambda value: value.item())
+        os.replace(self.state_file+'.partial', self.state_file)
+    
     def import_csv(self):
-        '''First import the csv with the data'''
-        df = pd.read_csv(self.file_location)
+        '''Imports the rows after the last processed time, up to the end of the month of the report'''
+        
+        if self.state is not None and self.state.get('aggregation', 'grid') != self.aggregation:
+            self.state = None # the aggregate so far can not be continued with another aggregation
+        
+        end = export_end(self.file_location) # before reading, rows that are appended meanwhile are read next time
+        source = (self.state or {}).get('source')
+        
+        if self.state is None:
+            df = read_export(self.file_location, self.recipe.columns)
+        else:
+            initial = pd.Series(self.state['last_row'])
+            initial['time'] = pd.Timestamp(initial['time'])
+            # A grown month so far export is read from the end of the earlier run, the time filter stays for the rest
+            offset = export_offset(self.file_location, source)
+            df = read_export(self.file_location, self.recipe.columns, since = initial['time'], initial = initial, offset = offset)
+            self.initial = initial
+            
+            if len(df) and df['time'].iloc[0].strftime('%Y-%m') != self.state['save_period']:
+                self.state = None # the month of the state is complete, start the next month
+        
+        if self.state is not None:
+            self.period = self.state['period']
+            self.save_period = self.state['save_period']
+        elif len(df):
+            self.period = df['time'].iloc[0].strftime('%B-%Y')
+            self.save_period = df['time'].iloc[0].strftime('%Y-%m')
+        else:
+            raise ValueError(f'No data in {self.file_location}')
+        
+        month_end = pd.Timestamp(self.save_period+'-01') + pd.offsets.MonthBegin(1)
+        cut = len(df) and df['time'].iloc[-1] >= month_end
+        df = df[df['time'] < month_end]
+        self.source = source if cut else end # the rows of the next month are read again next time
+        
+        self.last_row = df.iloc[-1] if len(df) else initial
+        
+        return df
+    
+    def check_quality(self, dataframe):
+        '''
+        The quality of the new rows combined with the quality of the month so far. The new rows are checked from the
+        last row of the earlier data, so a gap, a counter reset or a flat line at the boundary is not missed.
+        '''
+        
+        earlier = (self.state or {}).get('quality')
+        if earlier is None:
+            return data_quality(dataframe)
+        
+        df = dataframe
+        previous = pd.DataFrame([self.initial])[df.columns].astype(df.dtypes.to_dict())
+        later = data_quality(pd.concat([previous, df], ignore_index = True), last_change = earlier.get('last_change'))
+        later['rows'] -= 1 # the last row of the earlier data is counted there
+        
+        return combine_quality(earlier, later)
+    
+    def create_error_list(self, dataframe, tag, codes = TRIP_CODES):
+        '''The trips of the new rows joined to the trips so far, a trip that was open at the end of the earlier data continues'''
+        
+        df = dataframe
+        time = pd.DatetimeIndex(df['time'] if 'time' in df.columns else df.index)
+        
+        previous = (self.state or {}).get('trips', {}).get(tag, {'closed': [], 'open': None, 'last': None})
+        closed = pd.DataFrame(previous['closed'], columns = ['Date', 'endDate'], dtype = 'datetime64[ns]')
+        open_start = pd.Timestamp(previous['open']) if previous['open'] else None
+        last = pd.Timestamp(previous['last']) if previous['last'] else None
+        
+        if len(time):
+            active = np.isin(np.asarray(df[tag]), codes)
+            new = detect_events(time, df[tag], codes)[['Date', 'endDate']]
+            
+            if open_start is not None and active[0]:
+                new.loc[0, 'Date'] = open_start
+            elif open_start is not None:
+                new = pd.concat([pd.DataFrame({'Date': [open_start], 'endDate': [time[0]]}), new], ignore_index = True)
+            
+            open_start = new['Date'].iloc[-1] if active[-1] else None
+            if active[-1]:
+                new = new.iloc[:-1]
+            
+            closed = pd.concat([closed, new], ignore_index = True)
+            last = time[-1]
+        
+        self.trip_state[tag] = {
+            'closed': [[start.isoformat(), end.isoformat()] for start, end in zip(closed['Date'], closed['endDate'])],
+            'open': open_start.isoformat() if open_start is not None else None,
+            'last': last.isoformat() if last is not None else None,
+            }
+        
+        # In the report a trip that is still open ends at the last timestamp, like in a full month report
+        if open_start is not None:
+            closed = pd.concat([closed, pd.DataFrame({'Date': [open_start], 'endDate': [last]})], ignore_index = True)
+        
+        closed.insert(1, 'Duration', closed['endDate'] - closed['Date'])
+        
+        return closed
+    
+    def resample_data(self, dataframe):
+        '''Only the 5 minute periods after the last processed period are new'''
+        
+        df = super().resample_data(dataframe)
+        
+        if self.state is not None:
+            df = df[df.index > pd.Timestamp(self.state['last_bin'])]
+        
+        return df
+    
+    def aggregate_states(self, dataframe):
+        '''
+        The aggregate of the new data folded into the running aggregate.
+        With time weighting the last row of the earlier data holds until the first new row, that time is added here.
+        '''
+        
+        df = dataframe
+        if self.aggregation == 'time' and self.state is not None and len(df):
+            previous = pd.DataFrame([self.initial])[df.columns].astype(df.dtypes.to_dict())
+            df = pd.concat([previous, df], ignore_index = True)
+        
+        aggregate = super().aggregate_states(df)
+        
+        if self.state is not None:
+            aggregate = StateAggregate.from_dict(self.state['aggregate']) + aggregate
+        
+        return aggregate
+    
+    def calculate_energy(self, dataframe, column_names, rollover = None):
+        '''Energy of the new data, counted from the last counter values and added to the totals so far'''
+        
+        df = dataframe
+        
+        columns = [column_names] if isinstance(column_names, str) else list(column_names)
+        previous = (self.state or {}).get('counters', {})
+        
+        initial = [previous[column]['last'] for column in columns] if all(column in previous for column in columns) else None
+        totals, daily = integrate_counters(df, columns, rollover, initial = initial)
+        
+        for column in columns:
+            if column in previous:
+                totals[column] += previous[column]['total']
+            last = df[column].iloc[-1] if len(df) else previous[column]['last']
+            self.counter_state[column] = {'last': float(last), 'total': float(totals[column])}
+        
+        if self.state is not None and self.state.get('daily_energy'):
+            earlier = pd.DataFrame(self.state['daily_energy'])
+            earlier = earlier.set_index(pd.DatetimeIndex(earlier.pop('date'), name = 'date'))
+            daily = pd.concat([earlier, daily]).groupby(level = 0).sum()
+        self.daily_energy = daily
+        
+        if isinstance(column_names, str):
+            return float(totals[column_names])
+        return totals
+
+class TemplateCache:
+    '''
+    Template workbooks that are parsed once. The parsed workbook is kept pickled as a pristine copy and every report
+    gets its own clone from it, unpickling is several times faster than parsing the xlsx file again.
+    A template that changed on disk is parsed again.
+    '''
+    
+    def __init__(self, folder = BASE_FOLDER):
+        self.folder = folder
+        self.workbooks = {} # file: (modification time, pickled workbook)
+        self.lock = threading.Lock()
+    
+    def load(self, file):
+        '''A new workbook of the template file (relative to the folder)'''
+        
+        from openpyxl import load_workbook
+        
+        path = os.path.join(self.folder, file)
+        modified = os.path.getmtime(path)
+        
+        with self.lock:
+            cached = self.workbooks.get(file)
+            if cached is None or cached[0] != modified:
+                cached = (modified, pickle.dumps(load_workbook(filename = path), protocol = pickle.HIGHEST_PROTOCOL))
+                self.workbooks[file] = cached
+        
+        return pickle.loads(cached[1])
+    
+    def preload(self, files):
+        for file in files:
+            self.load(file)
+
+templates = TemplateCache()
+
+def report_file_name(report, extension):
+    '''File of a report in its output folder'''
+    return report.folder_location+'/'+report.site+' - maandrapportage bedrijfsvoering '+report.save_period+extension
+
+class ExportToExcel:
+    '''The template of the site filled in with the KPIs and the trip list, the default output'''
+    
+    def __init__(self, StandardizedReport, interactive = True):
+        
+        self.exd = StandardizedReport # exd = external data, shortened for ease of use
+        self.interactive = interactive # False when there is no GUI, failures are raised instead of shown
+        self.file_name = None
+        
+        template = self.exd.recipe.template
+        
+        if template is not None:
+            self.print_template(template)
+            if self.exd.profiler.enabled:
+                self.exd.profiler.write(os.path.splitext(self.file_name)[0])
+            
+        elif self.interactive:
+            messagebox.showinfo('Information', 'Report failure')
+            
+        else:
+            raise ValueError(f'No report template for site {self.exd.site!r}')
+    
+    def save(self, wb):
+        '''Saves the filled in template in the output folder'''
+        
+        self.file_name = report_file_name(self.exd, '.xlsx')
+        with self.exd.profiler.stage('save_workbook'):
+            wb.save(filename = self.file_name)
+        
+        if self.interactive:
+            messagebox.showinfo('Information', 'Report for '+self.exd.period+' '+self.exd.site+' was created')
+            
+    def print_trip_table(self, ws, skip):
+        '''
+        Writes the trip list into the table of the template that starts at row skip.
+        All rows are inserted in one go, so the rows below the table are shifted once instead of once per trip.
+        The border styles are shared by all rows and the values are formatted for the whole list at once.
+        '''
+        
+        trips = self.exd.error_list
+        if len(trips) == 0:
+            return
         
-        '''Next do the first transformations'''
+        ws.insert_rows(idx = skip, amount = len(trips))
         
-        df['time'] = pd.to_datetime(df['time'])
-        df.sort_values(by=['time'], inplace = True)
-        df.reset_index(drop=True, inplace = True)
+        from openpyxl.styles import Border, Side
         
-        df.fillna(method = 'ffill', inplace = True)
-        df.fillna(method = 'bfill', inplace = True)
+        thin = Side(border_style="thin", color="000000")
+        left = Border(left = thin)
+        right = Border(right = thin)
         
-        # Some time data for saving purposes
-        self.period = df['time'].dt.strftime('%B-%Y')[0]
-        self.save_period = df['time'].dt.strftime('%Y-%m')[0]
+        start = trips['Date'].dt.strftime('%Y-%m-%d %H:%M')
+        hours = np.ceil(100*trips['Duration'].dt.total_seconds()/60/60)/100
+        end = trips['endDate'].dt.strftime('%Y-%m-%d')
         
-        return df
+        for i, values in enumerate(zip(start, hours.tolist(), end), start = skip):
+            ws.merge_cells(start_row=i, start_column=4, end_row=i, end_column=6)
+            ws.cell(row = i, column = 2, value = values[0]).border = left
+            ws.cell(row = i, column = 3, value = values[1])
+            ws.cell(row = i, column = 7, value = values[2])
+            ws.cell(row = i, column = 8).border = right
     
-    def create_error_list(self, dataframe, tag):
+    def print_template(self, template):
+        '''Fills in the cells of the template from the KPIs of the report, then the trip table'''
         
-        df = dataframe
-        tag = tag
-        Error = False # priming the check variable
-        time_start = [] # priming a time counter
-        time_duration = []
-        time_end = []
-        Error_data = []
-        i = 0
-
-        # Iterate over the dataframe
-        for index, row in df.iterrows():
-                
-            if (row[tag] == 90 or row[tag] == 99) and Error == False:
-                Error = True
-                time_start = row['time']
-                Error_data.append(row['time'])
-                time_duration.append(row['time'] - time_start)
-                time_end.append(row['time'])
-            elif (row[tag] == 90 or row[tag] == 99):
-                Error = True
-            elif (row[tag] != 90 or row[tag] != 99) and Error == True:
-                time_duration[i] = (row['time'] - time_start)
-                time_end[i] = (row['time'])
-                i = i+1
-                Error = False
-            else:
-                Error = False
+        profiler = self.exd.profiler
         
-        trip_data = pd.DataFrame([Error_data, time_duration, time_end]).T
-        trip_data.columns = ['Date','Duration', 'endDate']
+        with profiler.stage('load_template'):
+            wb = templates.load(template.file)
+            ws = wb.worksheets[0]
         
-        return trip_data
-    
-    def resample_data(self, dataframe):
+        with profiler.stage('fill_cells'):
+            template.cells.fill(ws, vars(self.exd))
         
-        df = dataframe
-        df = df.set_index('time').resample('300S').bfill()
+        with profiler.stage('print_trip_table') as stage:
+            self.print_trip_table(ws, template.trip_table)
+            stage['rows'] = len(self.exd.error_list)
         
-        return df
-    
-    def calculate_basic_data(self, dataframe):
+        if self.exd.quality is not None:
+            self.print_quality(wb)
         
-        df = dataframe
+        self.save(wb)
+    
+    def print_quality(self, wb):
+        '''The data quality summary on a sheet of its own, after the report'''
+        
+        ws = wb.create_sheet('Datakwaliteit')
+        ws.column_dimensions['A'].width = 40
+        ws.column_dimensions['B'].width = 22
+        for key, label, value in quality_rows(self.exd.quality):
+            ws.append([label, value])
 
-        '''Get the basic data for the report'''
+#%% Output backends without the template
 
-        self.biogas = df[df['SEQSTATE']==62]['RHA10CF001'].sum()/12 # from 5 minute data, sum of biogas flow in production [Nm3]
-        self.biogas_CH4 = df[(df['SEQSTATE']==62) & (df['RHH15_CH4']>25)]['RHH15_CH4'].mean() # from 5 minute data, average of biogas methane [%]
+'''
+Besides the filled in template a report can be written as plain numbers, for dashboards and for large batch runs
+that do not need the Excel layout:
+    json         the KPIs and the trip lists in one file
+    csv          the KPIs (kpi, value) and the trip lists (list, start, end, hours) in two files
+    xlsx-stream  a write-only workbook with a KPI sheet and a trip sheet, rows are streamed to the file so very
+                 long trip lists take little memory and time
+The KPIs are the attributes that the recipe of the site set on the report, see StandardizedReport.calculate_kpis.
+'''
 
-        self.biomethane = df[df['SEQSTATE']==62]['NormalFlow'].sum()/12 # from 5 minute data, sum of biomethane flow in production [Nm3]
-        self.biomethane_CH4 = df[df['SEQSTATE']==62]['RHH10_CH4'].mean() # from 5 minute data, average of biomethane methane [%]
+TRIP_LISTS = {'SEQSTATE': 'error_list', 'SEQSTATE_CO2': 'error_list_CO2'} # state column: attribute with its trips
 
-        self.capacity = (50+(df[df['SEQSTATE']==62]['RHM50AN001']/2)-(df[df['SEQSTATE']==62]['RHM50AA106']/2)).mean()
-        self.methane_slip = 100*(1-(self.biomethane*self.biomethane_CH4/self.biogas/self.biogas_CH4)) # Guestimate for slip, must be measured [%]
+def report_kpis(report):
+    '''The KPI values of a report as plain numbers and strings, NaN as None'''
+    
+    kpis = {}
+    for name in report.kpi_names:
+        value = getattr(report, name)
+        if isinstance(value, np.number):
+            value = value.item()
+        if isinstance(value, float) and math.isnan(value):
+            value = None
+        if value is None or isinstance(value, (bool, int, float, str)):
+            kpis[name] = value
+    return kpis
 
-        ''''Availability hours'''
+def trip_lists(report):
+    '''{state column: frame with start, end and hours} of the trip lists the report has'''
+    
+    lists = {}
+    for column, attribute in TRIP_LISTS.items():
+        trips = getattr(report, attribute, None)
+        if trips is not None:
+            lists[column] = pd.DataFrame({
+                'start': trips['Date'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                'end': trips['endDate'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                'hours': np.ceil(100*trips['Duration'].dt.total_seconds()/60/60)/100, # as in the template
+                })
+    return lists
 
-        self.trip = math.floor(df[(df['SEQSTATE'] == 90) | (df['SEQSTATE']==99)]['SEQSTATE'].count()/12)
-        self.standby = math.floor(df[df['SEQSTATE'] == 1]['SEQSTATE'].count()/12)
-        self.running = math.ceil((df['SEQSTATE'].count()/12)-self.trip-self.standby)
+class ReportExport(ABC):
+    '''
+    Base of the exports without a template: writes the report with write(), records the stage in the profiler and
+    writes the timings next to the file like ExportToExcel.
+    '''
     
-    def installation_specific_data(self, dataframe):
-        
-        df = dataframe
+    stage = None
+    
+    def __init__(self, StandardizedReport, interactive = True):
         
-        if self.site == 'B0565 - Delfland Houtrust':
-
-            (self.trip_CO2LIQ, self.standby_CO2LIQ, self.running_CO2LIQ) = self.calculate_availability(self.monthly_report_database, 'CO2LIQ')
-            (self.trip_heatpump, self.standby_heatpump, self.running_heatpump) = self.calculate_availability(self.monthly_report_database, 'Heatpump')
-            self.total_energy = self.calculate_energy(self.monthly_report_database, 'Energy')
-            self.total_energy_CO2 = self.calculate_energy(self.monthly_report_database, 'Energy_CO2')
-            self.total_energy_HP = self.calculate_energy(self.monthly_report_database, 'Energy_HP')
-            
-        elif self.site == 'B0933 - Dommel':
-            self.total_energy = self.calculate_energy(self.monthly_report_database, 'Energy')
-            (self.trip_CO2LIQ, self.standby_CO2LIQ, self.running_CO2LIQ) = self.calculate_availability(self.monthly_report_database, 'SEQSTATE_CO2', normal = False)
-            self.methane_slip = (df[(df['SEQSTATE']==62) & (df['SEQSTATE_CO2'].isin([1,2,90,99]))]['Methane_slip'].mean()/100) * \
-                (df[(df['SEQSTATE']==62) & (df['RHH15_CH4']>25)]['RHH15_CH4'].mean()/100) * \
-                (101325*16.04/8.314/273.15)
-            self.methane_slip_CO2LIQ_active = (df[(df['SEQSTATE']==62) & (df['SEQSTATE_CO2']==20)]['Methane_slip'] * \
-                (df[(df['SEQSTATE']==62) & (df['SEQSTATE_CO2']==20)]['Methane_slip_factor']/100)).mean()
-            self.total_energy_CO2 = self.calculate_energy(self.monthly_report_database, 'Energy_CO2_2 (kWh)')
-            self.mean_H2S_treated = self.calculate_H2S_correction_Dommel(self.monthly_report_database)
-            self.error_list_CO2 = self.create_error_list(self.monthly_report_database, 'SEQSTATE_CO2')
-            
-        elif self.site == 'H4187 - Twence':
-            self.methane_slip = 'n.v.t.'
-            
-        elif self.site == 'PR000041 - Dieckmann':
-            (self.trip_CO2LIQ, self.standby_CO2LIQ, self.running_CO2LIQ) = self.calculate_availability(self.monthly_report_database, 'SEQSTATE_CO2', normal = False)
-            
-        else:
-            pass
-            
-    def calculate_availability(self, dataframe, column_name, normal = True):
+        self.exd = StandardizedReport
+        self.interactive = interactive
+        self.file_name = None
         
-        df = dataframe
+        with self.exd.profiler.stage(self.stage):
+            self.write()
         
-        '''Availability hours'''
+        if self.exd.profiler.enabled:
+            self.exd.profiler.write(report_file_name(self.exd, ''))
         
-        if normal == True:
-            trip = math.floor(df[df[column_name] == 5][column_name].count()/12)
-            standby = math.floor(df[df[column_name] == 1][column_name].count()/12)
-            running = math.ceil((df[column_name].count()/12)-trip-standby)
-        else:
-            trip = math.floor(df[(df[column_name] == 90) | (df[column_name] == 99) | (df[column_name] == 1)][column_name].count()/12)
-            standby = math.floor(df[df[column_name] == 2][column_name].count()/12)
-            running = math.ceil((df[column_name].count()/12)-trip-standby)
+        if self.interactive:
+            messagebox.showinfo('Information', 'Report for '+self.exd.period+' '+self.exd.site+' was created')
+    
+    def header(self):
+        return {'site': self.exd.site, 'period': self.exd.save_period, 'aggregation': self.exd.aggregation,
+                'source': self.exd.file_location and os.path.abspath(self.exd.file_location), 'version': __version__}
+    
+    @abstractmethod
+    def write(self):
+        '''Writes the report and sets file_name'''
+
+class ExportToJSON(ReportExport):
+    stage = 'write_json'
+    
+    def write(self):
+        data = dict(self.header(), kpis = report_kpis(self.exd), quality = self.exd.quality,
+                    trips = {column: trips.to_dict(orient = 'records') for column, trips in trip_lists(self.exd).items()})
         
-        return trip, standby, running
+        self.file_name = report_file_name(self.exd, '.json')
+        with open(self.file_name, 'w') as file:
+            json.dump(data, file, indent = 1)
+
+class ExportToCSV(ReportExport):
+    '''The KPIs in <report>.kpis.csv, the trips in <report>.trips.csv and the data quality in <report>.quality.csv'''
+    
+    stage = 'write_csv'
+    
+    def write(self):
+        self.file_name = report_file_name(self.exd, '.kpis.csv')
+        with open(self.file_name, 'w', newline = '') as file:
+            writer = csv.writer(file)
+            writer.writerow(['kpi', 'value'])
+            writer.writerows(self.header().items())
+            writer.writerows(report_kpis(self.exd).items())
+        
+        lists = trip_lists(self.exd)
+        trips = pd.concat([trips.assign(list = column) for column, trips in lists.items()], ignore_index = True) if lists else pd.DataFrame()
+        trips.reindex(columns = ['list', 'start', 'end', 'hours']).to_csv(report_file_name(self.exd, '.trips.csv'), index = False)
+        
+        if self.exd.quality is not None:
+            with open(report_file_name(self.exd, '.quality.csv'), 'w', newline = '') as file:
+                writer = csv.writer(file)
+                writer.writerow(['item', 'value'])
+                writer.writerows((key, value) for key, label, value in quality_rows(self.exd.quality))
+
+class ExportToStreamingExcel(ReportExport):
+    '''
+    A write-only workbook <report> - data.xlsx with the sheets KPIs, Trips and Quality, the rows go to the file as
+    they are written. It has its own name, so it does not replace the report from the template.
+    '''
+    
+    stage = 'write_xlsx_stream'
+    
+    def write(self):
+        from openpyxl import Workbook
+        
+        wb = Workbook(write_only = True)
+        
+        ws = wb.create_sheet('KPIs')
+        ws.append(['kpi', 'value'])
+        for row in list(self.header().items()) + list(report_kpis(self.exd).items()):
+            ws.append(row)
+        
+        ws = wb.create_sheet('Trips')
+        ws.append(['list', 'start', 'end', 'hours'])
+        for column, trips in trip_lists(self.exd).items():
+            for row in zip(trips['start'], trips['end'], trips['hours'].tolist()):
+                ws.append((column,) + row)
+        
+        if self.exd.quality is not None:
+            ws = wb.create_sheet('Quality')
+            ws.append(['item', 'value'])
+            for key, label, value in quality_rows(self.exd.quality):
+                ws.append([key, value])
+        
+        self.file_name = report_file_name(self.exd, ' - data.xlsx')
+        wb.save(self.file_name)
+
+OUTPUT_FORMATS = {
+    # name: export class, called with the report like ExportToExcel
+    'xlsx': ExportToExcel,
+    'xlsx-stream': ExportToStreamingExcel,
+    'json': ExportToJSON,
+    'csv': ExportToCSV,
+    }
+
+def export_report(report, output_format = 'xlsx', interactive = False):
+    '''Writes the report in the given output format and returns the file'''
+    
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format {output_format!r}')
+    return OUTPUT_FORMATS[output_format](report, interactive = interactive).file_name
+
+#%% Monthly rollup of long exports
+
+'''
+A long export (several months up to years) is read once and split by calendar month. Every month is reported on
+in its own worker process with the normal pipeline and template, and a summary workbook shows the trends of the
+months next to each other.
+'''
 
-    def calculate_energy(self, dataframe, column_name):
+class MonthReport(StandardizedReport):
+    '''Report of one calendar month of an export that was already read, frame holds the filled rows of the month'''
+    
+    def __init__(self, site, frame, folder_location, recipes = None, profiler = None, aggregation = None):
+        self.frame = frame
+        super().__init__(site, None, folder_location, cache = False, recipes = recipes, profiler = profiler, aggregation = aggregation)
+    
+    def import_csv(self):
+        df = self.frame.set_axis(pd.RangeIndex(len(self.frame)), copy = False)
+        del self.frame
         
-        df = dataframe
+        self.period = df['time'].iloc[0].strftime('%B-%Y')
+        self.save_period = df['time'].iloc[0].strftime('%Y-%m')
         
-        total_energy = 0
-        previous = None
+        return df
 
-        for index, row in df.iterrows():
-            current = row[column_name]
-            
-            if previous is None:
-                previous = current
+def split_months(dataframe):
+    '''Yields (month, rows of the month) for every calendar month in the data, in order'''
+    
+    for month, frame in dataframe.groupby(dataframe['time'].dt.to_period('M'), sort = True):
+        yield str(month), frame
+
+def month_summary(report):
+    '''
+    The KPIs of a month report that are shown in the rollup summary, None where the site does not have them.
+    The methane slip is the estimate in % of the biomethane, or the measured slip in g CH4/Nm3 biogas: these are
+    separate KPIs so values in different units are never compared.
+    '''
+    
+    kpi = vars(report)
+    number = lambda name: kpi[name] if isinstance(kpi.get(name), (int, float, np.number)) else None
+    kpi_names = [kpi_name for kpi_name, params in report.recipe.kpis]
+    counters = [name for kpi_name, params in report.recipe.kpis if kpi_name == 'energy' for name in params['counters']]
+    
+    summary = {'month': report.save_period, 'running': number('running'), 'standby': number('standby'), 'trip': number('trip')}
+    
+    hours = sum(summary[name] or 0 for name in ('running', 'standby', 'trip'))
+    summary['availability'] = 100*(1-summary['trip']/hours) if hours else None
+    summary['biogas'] = number('biogas')
+    summary['biomethane'] = number('biomethane')
+    measured = 'methane_slip_measured' in kpi_names
+    summary['methane_slip'] = None if measured else number('methane_slip')
+    summary['methane_slip_measured'] = number('methane_slip') if measured else None
+    summary['trips'] = len(report.error_list)
+    summary['energy'] = {name: number(name) for name in counters}
+    
+    # kWh of the first counter of the recipe (the whole installation) per Nm3 of biogas
+    energy = summary['energy'][counters[0]] if counters else None
+    summary['energy_intensity'] = energy/summary['biogas'] if energy is not None and summary['biogas'] else None
+    
+    return {name: float(value) if isinstance(value, np.number) else value for name, value in summary.items()}
+
+def run_month(site, frame, folder_location, profile = False, aggregation = None, output_format = 'xlsx'):
+    '''Creates the report of one month, this runs in a worker process'''
+    
+    profiler = StageProfiler(enabled = profile)
+    try:
+        report = MonthReport(site, frame, folder_location, profiler = profiler, aggregation = aggregation)
+        summary = month_summary(report)
+        summary['file'] = export_report(report, output_format)
+    finally:
+        profiler.stop()
+    
+    return summary
+
+ROLLUP_COLUMNS = [
+    # (header, summary key, number format)
+    ('Maand', 'month', None),
+    ('Beschikbaarheid [%]', 'availability', '0.0'),
+    ('Bedrijfsuren [h]', 'running', '0'),
+    ('Stand-by [h]', 'standby', '0'),
+    ('Storing [h]', 'trip', '0'),
+    ('Aantal storingen', 'trips', '0'),
+    ('Biogas [Nm3]', 'biogas', '#,##0'),
+    ('Biomethaan [Nm3]', 'biomethane', '#,##0'),
+    ('Methaanslip [%]', 'methane_slip', '0.00'),
+    ('Methaanslip gemeten [g CH4/Nm3 biogas]', 'methane_slip_measured', '0.00'),
+    ('Energie-intensiteit [kWh/Nm3 biogas]', 'energy_intensity', '0.000'),
+    ]
+
+def write_summary_table(ws, rows, columns, chart_keys, chart_type = 'line'):
+    '''
+    Writes rows of summaries as a table with the columns [(header, key, number format)], with a chart per key of
+    chart_keys against the first column below the table.
+    '''
+    
+    from openpyxl.chart import LineChart, BarChart, Reference
+    
+    ws.append([header for header, key, number_format in columns])
+    for row in rows:
+        ws.append(row)
+    
+    for index, (header, key, number_format) in enumerate(columns, start = 1):
+        ws.column_dimensions[ws.cell(row = 1, column = index).column_letter].width = max(12, len(header)+2)
+        if number_format:
+            for row in ws.iter_rows(min_row = 2, min_col = index, max_col = index):
+                row[0].number_format = number_format
+    
+    categories = Reference(ws, min_col = 1, min_row = 2, max_row = len(rows)+1)
+    anchor_row = len(rows)+4
+    
+    for key in chart_keys:
+        index = next((index for index, column in enumerate(columns, start = 1) if column[1] == key), None)
+        if index is None:
+            continue
+        chart = LineChart() if chart_type == 'line' else BarChart()
+        chart.title = columns[index-1][0]
+        chart.legend = None
+        chart.width = 24
+        chart.add_data(Reference(ws, min_col = index, min_row = 1, max_row = len(rows)+1), titles_from_data = True)
+        chart.set_categories(categories)
+        ws.add_chart(chart, f'A{anchor_row}')
+        anchor_row += 16
+
+def write_rollup_summary(site, summaries, folder_location):
+    '''Writes the summary workbook of the months, with a line chart per trend, and returns its file name'''
+    
+    from openpyxl import Workbook
+    
+    counters = list(summaries[0]['energy'])
+    columns = [column for column in ROLLUP_COLUMNS if any(summary[column[1]] is not None for summary in summaries)]
+    columns += [(f'{name} [kWh]', name, '#,##0') for name in counters]
+    
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Jaaroverzicht'
+    
+    rows = [[summary['energy'][key] if key in counters else summary[key] for header, key, number_format in columns] for summary in summaries]
+    write_summary_table(ws, rows, columns, ('availability', 'energy_intensity', 'methane_slip', 'methane_slip_measured'))
+    
+    first, last = summaries[0]['month'], summaries[-1]['month']
+    period = first[:4] if first[:4] == last[:4] else first+' - '+last
+    file_name = folder_location+'/'+site+' - jaaroverzicht bedrijfsvoering '+period+'.xlsx'
+    wb.save(filename = file_name)
+    
+    return file_name
+
+def rollup(site, file_location, folder_location, workers = None, profile = False, aggregation = None, output_format = 'xlsx', trip_index = False):
+    '''
+    Reports on every calendar month of a long export, the months run in parallel worker processes.
+    Returns the summaries of the months (with the file of each month report) and the file of the summary workbook.
+    With trip_index the trips of the export are added to the trip index.
+    '''
+    
+    df = read_export(file_location, load_recipes().get(site).columns)
+    if df.empty:
+        raise ValueError(f'No data in {file_location}')
+    
+    if trip_index: # once for the whole export, the month reports leave the index alone
+        TripIndex().update(site, trip_events(df), df['time'].iloc[0], df['time'].iloc[-1])
+    
+    months = list(split_months(df))
+    del df
+    
+    if workers == 1 or len(months) == 1:
+        summaries = [run_month(site, frame, folder_location, profile, aggregation, output_format) for month, frame in months]
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = [pool.submit(run_month, site, frame, folder_location, profile, aggregation, output_format) for month, frame in months]
+            del months
+            summaries = [future.result() for future in futures]
+    
+    return summaries, write_rollup_summary(site, summaries, folder_location)
+
+#%% Fleet overview
+
+'''
+The fleet overview compares the installations over one period: availability, operating hours, trips, production,
+methane slip and energy intensity per export, in one table. The parent process reads the exports one by one into
+shared memory and a worker process computes the KPIs of each export from there, the frames are never pickled.
+A worker starts on an export as soon as it is read, while the parent reads the next one.
+'''
+
+class SharedFrame:
+    '''
+    The columns of a frame in one block of shared memory. The process that creates it owns the block, worker
+    processes attach to it with its spec (a small dictionary) and get a frame on the same memory.
+    '''
+    
+    ALIGNMENT = 64 # bytes, every column starts at a multiple of this
+    
+    def __init__(self, memory, spec, owner):
+        self.memory = memory
+        self.spec = spec
+        self.owner = owner
+        self.closed = False
+    
+    @classmethod
+    def create(cls, dataframe):
+        from multiprocessing.shared_memory import SharedMemory
+        
+        columns, offset = [], 0
+        for name in dataframe.columns:
+            dtype = dataframe[name].to_numpy().dtype
+            columns.append((name, dtype.str, offset))
+            offset += -(-len(dataframe)*dtype.itemsize//cls.ALIGNMENT)*cls.ALIGNMENT
+        
+        memory = SharedMemory(create = True, size = max(offset, 1))
+        shared = cls(memory, {'name': memory.name, 'rows': len(dataframe), 'columns': columns}, owner = True)
+        for name, dtype, offset in columns:
+            shared.array(dtype, offset)[:] = dataframe[name].to_numpy()
+        
+        return shared
+    
+    @classmethod
+    def attach(cls, spec):
+        from multiprocessing.shared_memory import SharedMemory
+        return cls(SharedMemory(name = spec['name']), spec, owner = False)
+    
+    def array(self, dtype, offset):
+        return np.ndarray(self.spec['rows'], dtype = np.dtype(dtype), buffer = self.memory.buf, offset = offset)
+    
+    def frame(self):
+        '''A frame on the shared memory, without a copy'''
+        return pd.DataFrame({name: self.array(dtype, offset) for name, dtype, offset in self.spec['columns']}, copy = False)
+    
+    def close(self):
+        '''Closes the block, the owner also frees it. Frames on the block must be gone by then.'''
+        
+        if self.closed:
+            return
+        self.closed = True
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+def run_fleet_site(site, spec, aggregation = None):
+    '''The summary of the KPIs of one export of the fleet, from the shared memory of the parent, this runs in a worker process'''
+    
+    shared = SharedFrame.attach(spec)
+    try:
+        report = MonthReport(site, shared.frame(), None, aggregation = aggregation)
+        summary = month_summary(report)
+        del report
+    finally:
+        try:
+            shared.close()
+        except BufferError: # a frame on the block is still referenced, the block is closed when the worker exits
+            pass
+    
+    return summary
+
+FLEET_COLUMNS = [('Installatie', 'site', None), ('Periode', 'month', None)] + [column for column in ROLLUP_COLUMNS if column[1] != 'month']
+
+def write_fleet_table(summaries, folder_location):
+    '''Writes the fleet overview workbook, one row per export with a bar chart per KPI, and returns its file name'''
+    
+    from openpyxl import Workbook
+    
+    columns = [column for column in FLEET_COLUMNS if any(summary[column[1]] is not None for summary in summaries)]
+    
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Vlootoverzicht'
+    
+    rows = [[summary[key] for header, key, number_format in columns] for summary in summaries]
+    write_summary_table(ws, rows, columns, ('availability', 'methane_slip', 'methane_slip_measured', 'energy_intensity'), chart_type = 'bar')
+    
+    months = sorted({summary['month'] for summary in summaries})
+    period = months[0] if len(months) == 1 else months[0]+' - '+months[-1]
+    file_name = folder_location+'/vlootoverzicht bedrijfsvoering '+period+'.xlsx'
+    wb.save(filename = file_name)
+    
+    return file_name
+
+def fleet(exports, folder_location, workers = None, aggregation = None, trip_index = False):
+    '''
+    KPIs of the exports [(site, file)] of a fleet in worker processes, from shared memory.
+    Returns the outcome per export (the summary of its KPIs when it succeeded) and the file of the fleet table,
+    None when no export succeeded. With trip_index the trips of the exports are added to the trip index.
+    '''
+    
+    results = []
+    
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for site, file_location in exports:
+            result = {'site': site, 'csv': file_location, 'status': 'ok', 'error': None}
+            results.append(result)
+            try:
+                df = read_export(file_location, load_recipes().get(site).columns)
+                if df.empty:
+                    raise ValueError(f'No data in {file_location}')
+                if trip_index:
+                    TripIndex().update(site, trip_events(df), df['time'].iloc[0], df['time'].iloc[-1])
+                shared = SharedFrame.create(df)
+                del df
+            except Exception as error:
+                result.update(status = 'failed', error = f'{type(error).__name__}: {error}')
                 continue
             
-            energy_diff = current-previous
-            
-            if energy_diff < 0:
-                energy_diff = 0
-            
-            total_energy += energy_diff
-            previous = current
-        return total_energy
-    
-    def calculate_H2S_correction_Dommel(self,dataframe):
-        df = dataframe
+            result['future'] = pool.submit(run_fleet_site, site, shared.spec, aggregation)
+            result['future'].add_done_callback(lambda future, shared = shared: shared.close()) # frees the block once it is done
         
-        df['H2S_in'] = df['H2S_in'].apply(lambda val: np.nan if val < 5 else val)
-        df['H2S_in'].interpolate(method='linear', inplace=True)
-        df = df[df['SEQSTATE'] == 62]
-        mean_H2S = (df['H2S_in']*df['RHA10CF001']).sum()/df['RHA10CF001'].sum()
-        
-        return mean_H2S
+        for result in results:
+            future = result.pop('future', None)
+            if future is None:
+                continue
+            try:
+                summary = future.result()
+            except Exception as error:
+                result.update(status = 'failed', error = f'{type(error).__name__}: {error}')
+            else:
+                result.update(summary, site = result['site'])
+    
+    summaries = [result for result in results if result['status'] == 'ok']
+    return results, write_fleet_table(summaries, folder_location) if summaries else None
 
+#%% Batch reporting without the GUI
 
-class ExportToExcel:
+def resolve_site(name):
+    '''Full site name from a site name or a site code, e.g. B0933'''
     
-    def __init__(self, StandardizedReport):
-        
-        self.exd = StandardizedReport # exd = external data, shortened for ease of use
-        
-        if self.exd.site == 'B0175 - Aquafin NV':
-            self.print_template_1()
-            
-        elif self.exd.site == 'B0218 - Delfland Harnaschpolder':
-            self.print_template_1()
-            
-        elif self.exd.site == 'H4242 - Delfland De Groote Lucht':
-            self.print_template_1()
-            
-        elif self.exd.site == 'H4187 - Twence':
-            self.print_template_1()
-            
-        elif self.exd.site == 'B0565 - Delfland Houtrust':
-            self.print_template_2()
-            
-        elif self.exd.site == 'B0933 - Dommel':
-            self.print_template_3()
-            
-        elif self.exd.site == 'PR000041 - Dieckmann':
-            self.print_template_4()
-            
+    for site in load_recipes().sites:
+        if name == site or name == site.split(' - ')[0]:
+            return site
+    raise ValueError(f'Unknown site {name!r}')
+
+def read_manifest(file_location, require_output = True):
+    '''
+    Reads the report jobs from a manifest: a csv file with the columns site, csv and output, or a json list of
+    objects with these keys. Relative paths are taken relative to the manifest. The output may only be left out
+    without require_output (the fleet overview has one output folder).
+    '''
+    
+    folder = os.path.dirname(os.path.abspath(file_location))
+    
+    if file_location.lower().endswith('.json'):
+        with open(file_location) as file:
+            entries = json.load(file)
+        rows = [f'entry {number}' for number in range(1, len(entries)+1)]
+    else:
+        with open(file_location, newline = '') as file:
+            entries = list(csv.DictReader(file))
+        rows = [f'line {number}' for number in range(2, len(entries)+2)] # after the header
+    
+    jobs = []
+    for row, entry in zip(rows, entries):
+        if require_output and not entry.get('output'):
+            raise ValueError(f'No output folder in {file_location}, {row}')
+        jobs.append({'site': resolve_site(entry['site']),
+                     'csv': os.path.join(folder, entry['csv']),
+                     'output': os.path.join(folder, entry['output']) if entry.get('output') else None})
+    
+    return jobs
+
+def run_report(job):
+    '''Creates one report without the GUI and returns the outcome, this runs in a worker process'''
+    
+    result = dict(job, status = 'ok', file = None, error = None)
+    start = time.perf_counter()
+    profiler = StageProfiler(enabled = job.get('profile', False))
+    
+    try:
+        os.makedirs(job['output'], exist_ok = True)
+        if job.get('rollup'):
+            summaries, result['file'] = rollup(job['site'], job['csv'], job['output'], job.get('workers'), job.get('profile', False), job.get('aggregation'), job.get('output_format', 'xlsx'), job.get('trip_index', False))
+            result['months'] = [summary['file'] for summary in summaries]
         else:
-            messagebox.showinfo('Information', 'Report failure')
-            
-    def print_template_1(self):
-        
-        skip = 26
-        
-        nvt = lambda x: x if isinstance(x, str) else round(x, 2)                # Lambda function to keep overall code short
-        
-        wb = load_workbook(filename =  os.getcwd()+'/BaseFiles/Template_1.xlsx')
-        ws = wb.worksheets[0]
+            trip_index = TripIndex() if job.get('trip_index') else None
+            if job.get('month_to_date'):
+                report = MonthToDateReport(job['site'], job['csv'], job['output'], profiler = profiler, aggregation = job.get('aggregation'), trip_index = trip_index)
+            else:
+                report = StandardizedReport(job['site'], job['csv'], job['output'], cache = job.get('cache'), profiler = profiler, aggregation = job.get('aggregation'), trip_index = trip_index)
+            result['file'] = export_report(report, job.get('output_format', 'xlsx'))
+    except Exception as error:
+        result['status'] = 'failed'
+        result['error'] = f'{type(error).__name__}: {error}'
+    finally:
+        profiler.stop()
+    
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    
+    return result
 
-        ws['C4'] = self.exd.site
-        ws['C5'] = self.exd.period
-        ws['C6'] = date.today()
+def run_batch(jobs, workers = None):
+    '''Runs the report jobs in a pool of worker processes, the results are in the order of the jobs'''
+    
+    if workers == 1 or len(jobs) <= 1:
+        return [run_report(job) for job in jobs]
+    
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(run_report, job) for job in jobs]
+        
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as error: # the worker process itself died
+                results.append(dict(job, status = 'failed', file = None, error = f'{type(error).__name__}: {error}', seconds = None))
+    
+    return results
 
-        ws['C11'] = round(self.exd.biogas,1)
-        ws['C12'] = round(self.exd.biogas_CH4,1)
-        ws['C15'] = round(self.exd.biomethane,1)
-        ws['C16'] = round(self.exd.biomethane_CH4,1)
+def result_line(result):
+    '''One line of output for the result of a report job'''
+    
+    outcome = result['file'] if result['status'] == 'ok' else result['error']
+    seconds = '-' if result['seconds'] is None else f"{result['seconds']:.1f}"
+    return f"{result['status']:<7}{seconds:>8} s  {result['site']}  {result['csv']} -> {outcome}"
 
-        ws['C18'] = round(self.exd.capacity)
-        ws['C19'] = nvt(self.exd.methane_slip)
+JOB_OPTIONS = ('cache', 'month_to_date', 'profile', 'rollup', 'workers', 'aggregation', 'output_format', 'trip_index') # keys of job_options
 
-        ws['G11'] = self.exd.running
-        ws['G12'] = self.exd.standby
-        ws['G13'] = '='+str(self.exd.trip)+'-G14-G15-G16'
-        ws['G14'] = 0
-        ws['G15'] = 0
-        ws['G16'] = 0
-        ws['G17'] = '=100*(1-((G13+G14+G15+G16)/(G11+G12+G13+G14+G15+G16)))'
-        
-        for i in range(skip,skip+len(self.exd.error_list)):
-            ws.insert_rows(idx = i)
-            ws.merge_cells(start_row=i, start_column=4, end_row=i, end_column=6)
-            thin = Side(border_style="thin", color="000000")
-            ws.cell(row = i, column = 2).border = Border(left = thin)
-            ws.cell(row = i, column = 8).border = Border(right = thin)
-            ws.cell(row = i, column = 2, value = self.exd.error_list['Date'][i-skip].strftime('%Y-%m-%d %H:%M'))
-            ws.cell(row = i, column = 3, value = math.ceil(100*self.exd.error_list['Duration'][i-skip].total_seconds()/60/60)/100)
-            ws.cell(row = i, column = 7, value = self.exd.error_list['endDate'][i-skip].strftime('%Y-%m-%d'))
+def job_options(args, single = False):
+    '''The options of the command line that every report job gets'''
+    
+    return {
+        'cache': False if args.no_cache else None,
+        'month_to_date': args.month_to_date,
+        'profile': args.profile,
+        'rollup': args.rollup,
+        'aggregation': args.aggregation,
+        'output_format': args.output_format,
+        'trip_index': args.trip_index,
+        'workers': args.workers if single else 1, # months in parallel only when there is one export
+        }
 
-        wb.save(filename = self.exd.folder_location+'/'+self.exd.site+' - maandrapportage bedrijfsvoering '+self.exd.save_period+'.xlsx')
-        
-        messagebox.showinfo('Information', 'Report for '+self.exd.period+' '+self.exd.site+' was created')
+def batch_main(args):
+    '''Batch mode of the command line, returns the exit code: 0 when every report was created, 1 otherwise'''
+    
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        if not (args.site and args.output):
+            raise SystemExit('--glob needs --site and --output')
+        site = resolve_site(args.site)
+        jobs = [{'site': site, 'csv': file_location, 'output': args.output} for file_location in sorted(glob.glob(args.glob))]
+    
+    if args.rollup and args.month_to_date:
+        raise SystemExit('--rollup and --month-to-date can not be combined')
+    
+    for job in jobs:
+        job.update(job_options(args, single = len(jobs) == 1))
+    
+    start = time.perf_counter()
+    results = run_batch(jobs, args.workers)
+    total = time.perf_counter() - start
+    
+    for result in results:
+        print(result_line(result))
+    
+    failed = sum(result['status'] != 'ok' for result in results)
+    print(f'{len(results)} reports, {len(results)-failed} created, {failed} failed in {total:.1f} s')
+    
+    if args.summary:
+        with open(args.summary, 'w') as file:
+            json.dump({'seconds': round(total, 3), 'failed': failed, 'reports': [{key: value for key, value in result.items() if key not in JOB_OPTIONS} for result in results]}, file, indent = 2)
+    
+    return 1 if failed else 0
 
-    def print_template_2(self):
-        
-        skip = 38
-        
-        wb = load_workbook(filename = os.getcwd()+'/BaseFiles/Template_2.xlsx')
-        ws = wb.worksheets[0]
+#%% Watch folder
+
+'''
+In watch mode the program keeps polling a folder, e.g. the shared download folder, and reports on every new export
+that appears. The site of an export follows from its file name (a site code such as B0933) or else from its columns.
+A file is only taken once its size and modification time have not changed for a while, so a download that is still
+being written is left alone. The reports run in a bounded pool of worker processes, one report per site at a time
+so month to date states are not updated twice at once. Every processed export is recorded in a ledger (json, in the
+output folder) by its content hash: an export that is copied or downloaded again is not reported on twice.
+'''
 
-        ws['C4'] = self.exd.site
-        ws['C5'] = self.exd.period
-        ws['C6'] = date.today()
+WATCH_LEDGER = 'burp watch ledger.json'
 
-        ws['C11'] = round(self.exd.biogas,1)
-        ws['C12'] = round(self.exd.biogas_CH4,1)
-        ws['C15'] = round(self.exd.biomethane,1)
-        ws['C16'] = round(self.exd.biomethane_CH4,1)
+def site_from_name(file_location, sites):
+    '''The site whose code (or full name) is in the file name, None when there is no single one'''
+    
+    name = os.path.basename(file_location)
+    found = [site for site in sites
+             if re.search(r'(?<![A-Za-z0-9])'+re.escape(site.split(' - ')[0])+r'(?![A-Za-z0-9])', name, re.IGNORECASE)]
+    return found[0] if len(found) == 1 else None
+
+def site_from_columns(file_location, recipes):
+    '''
+    The site whose recipe explains the columns of the export best: all its columns are in the export and it leaves
+    the fewest columns unexplained. None when no site or several sites fit equally well (same recipe columns).
+    '''
+    
+    with open(file_location, newline = '') as file:
+        header = set(next(csv.reader(file), [])) - {'time'}
+    
+    scores = {}
+    for site in recipes.sites:
+        columns = set(recipes.get(site).columns)
+        if columns <= header:
+            scores[site] = len(header - columns)
+    
+    if not scores:
+        return None
+    best = min(scores.values())
+    found = [site for site, score in scores.items() if score == best]
+    return found[0] if len(found) == 1 else None
 
-        ws['C18'] = round(self.exd.capacity)
-        ws['C19'] = round(self.exd.methane_slip,2)
+def detect_site(file_location, default = None):
+    '''Site of an export from its file name, its columns or else the default site'''
+    
+    recipes = load_recipes()
+    return site_from_name(file_location, recipes.sites) or site_from_columns(file_location, recipes) or default
 
-        ws['G11'] = self.exd.running
-        ws['G12'] = self.exd.standby
-        ws['G13'] = '='+str(self.exd.trip)+'-G14-G15-G16'
-        ws['G14'] = 0
-        ws['G15'] = 0
-        ws['G16'] = 0
-        ws['G17'] = '=100*(1-((G13+G14+G15+G16)/(G11+G12+G13+G14+G15+G16)))'
+class FolderWatcher:
+    '''
+    Polls a folder for new exports and creates their reports in a pool of worker processes.
+    
+    options are the job options of the reports (see job_options), settle the seconds a file has to stay unchanged
+    before it is taken, site the site of exports that are not recognised.
+    '''
+    
+    def __init__(self, folder, output, pattern = '*.csv', workers = None, interval = 5, settle = 10, site = None,
+                 options = None, ledger = None):
+        self.folder = folder
+        self.output = output
+        self.pattern = pattern
+        self.workers = workers or os.cpu_count() or 1
+        self.interval = interval
+        self.settle = settle
+        self.site = site
+        self.options = options or {}
         
-        ws['C22'] = self.exd.running_CO2LIQ
-        ws['C23'] = self.exd.standby_CO2LIQ
-        ws['C24'] = self.exd.trip_CO2LIQ
-        ws['C26'] = '=100*(1-(C24/(C22+C23+C24)))'
+        os.makedirs(output, exist_ok = True)
+        self.ledger_file = ledger or os.path.join(output, WATCH_LEDGER)
+        self.ledger = self.load_ledger()
         
-        ws['G22'] = self.exd.running_heatpump
-        ws['G23'] = self.exd.standby_heatpump
-        ws['G24'] = self.exd.trip_heatpump
-        ws['G26'] = '=100*(1-(G24/(G22+G23+G24)))'
+        self.seen = {} # file: (size, modification time, time it was first seen like this)
+        self.done = {} # file: (size, modification time) when it was taken
+        self.failed = set() # content hashes that failed in this run, retried on the next run
+        self.queue = [] # jobs waiting for a free worker
+        self.running = {} # future: job
+    
+    def load_ledger(self):
+        if not os.path.isfile(self.ledger_file):
+            return {}
+        with open(self.ledger_file) as file:
+            return json.load(file)
+    
+    def save_ledger(self):
+        '''Writes the ledger via a temporary file, like the month to date state'''
         
-        ws['C29'] = self.exd.total_energy
-        ws['C30'] = self.exd.total_energy_HP
-        ws['C31'] = self.exd.total_energy_CO2
+        with open(self.ledger_file+'.partial', 'w') as file:
+            json.dump(self.ledger, file, indent = 1)
+        os.replace(self.ledger_file+'.partial', self.ledger_file)
+    
+    def record(self, digest, result):
+        if result.get('status') != 'ok':
+            self.failed.add(digest)
+        self.ledger[digest] = {key: result.get(key) for key in ('site', 'csv', 'status', 'file', 'error', 'seconds')}
+        self.ledger[digest]['processed'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.save_ledger()
+        print(result_line(result), flush = True)
+    
+    def settled(self, now = None):
+        '''Files that did not change for settle seconds and were not taken yet in this state'''
         
-        ws['G29'] = 1000*self.exd.total_energy/self.exd.biogas
-        ws['G30'] = 1000*self.exd.total_energy_HP/self.exd.biogas
-        ws['G31'] = 1000*self.exd.total_energy_CO2/self.exd.biogas
+        now = time.time() if now is None else now
+        files = []
         
-        for i in range(skip,skip+len(self.exd.error_list)):
-            ws.insert_rows(idx = i)
-            ws.merge_cells(start_row=i, start_column=4, end_row=i, end_column=6)
-            thin = Side(border_style="thin", color="000000")
-            ws.cell(row = i, column = 2).border = Border(left = thin)
-            ws.cell(row = i, column = 8).border = Border(right = thin)
-            ws.cell(row = i, column = 2, value = self.exd.error_list['Date'][i-skip].strftime('%Y-%m-%d %H:%M'))
-            ws.cell(row = i, column = 3, value = math.ceil(100*self.exd.error_list['Duration'][i-skip].total_seconds()/60/60)/100)
-            ws.cell(row = i, column = 7, value = self.exd.error_list['endDate'][i-skip].strftime('%Y-%m-%d'))
-
-        wb.save(filename = self.exd.folder_location+'/'+self.exd.site+' - maandrapportage bedrijfsvoering '+self.exd.save_period+'.xlsx')
-        
-        messagebox.showinfo('Information', 'Report for '+self.exd.period+' '+self.exd.site+' was created')
-        
-    def print_template_3(self):
-        
-        skip = 32+4
-        
-        wb = load_workbook(filename = os.getcwd()+'/BaseFiles/Template_3.xlsx')
-        ws = wb.worksheets[0]
-
-        ws['C4'] = self.exd.site                                                # Project
-        ws['C5'] = self.exd.period                                              # Month
-        ws['C6'] = date.today()                                                 # Date of today
-
-        ws['C11'] = self.exd.biogas                                             # Produced amount of biogas
-        ws['C12'] = '=('+str(self.exd.mean_H2S_treated)+'/17)*C11'              # Weighed biogas treated with 17 ppm H2S
-        ws['G11'] = 0
-        ws['G12'] = '=(G11/50)*C11'
-
-        ws['C15'] = self.exd.running                                            # Running Hours
-        ws['C16'] = self.exd.standby
-        ws['C17'] = '='+str(self.exd.trip)+'-C18-C19-C20'
-        ws['C18'] = 0
-        ws['C19'] = 0
-        ws['C20'] = 0
-        ws['C21'] = '=100*(1-((C17+C18+C19+C20)/(C15+C16+C17+C18+C19+C120)))'
-        
-        ws['C25'] = round(self.exd.methane_slip,2)
-        
-        ws['C28'] = self.exd.total_energy
-        ws['C29'] = 1000*self.exd.total_energy/self.exd.biogas
-
-        ws['G15'] = self.exd.running_CO2LIQ
-        ws['G16'] = self.exd.standby_CO2LIQ
-        ws['G17'] = '='+str(self.exd.trip_CO2LIQ)+'-G18-G19-G20'
-        ws['G18'] = 0
-        ws['G19'] = 0
-        ws['G20'] = 0
-        ws['G21'] = '=100*(1-((G17+G18+G19+G20)/(G15+G16+G17+G18+G19+G20)))'
-        
-        ws['G25'] = self.exd.methane_slip_CO2LIQ_active
-        ws['G28'] = self.exd.total_energy_CO2/1000000
-        ws['G29'] = self.exd.total_energy_CO2/self.exd.biogas/1000
-                        
-        for i in range(skip,skip+len(self.exd.error_list)):
-            ws.insert_rows(idx = i)
-            ws.merge_cells(start_row=i, start_column=4, end_row=i, end_column=6)
-            thin = Side(border_style="thin", color="000000")
-            ws.cell(row = i, column = 2).border = Border(left = thin)
-            ws.cell(row = i, column = 8).border = Border(right = thin)
-            ws.cell(row = i, column = 2, value = self.exd.error_list['Date'][i-skip].strftime('%Y-%m-%d %H:%M'))
-            ws.cell(row = i, column = 3, value = math.ceil(100*self.exd.error_list['Duration'][i-skip].total_seconds()/60/60)/100)
-            ws.cell(row = i, column = 7, value = self.exd.error_list['endDate'][i-skip].strftime('%Y-%m-%d'))
-
-        wb.save(filename = self.exd.folder_location+'/'+self.exd.site+' - maandrapportage bedrijfsvoering '+self.exd.save_period+'.xlsx')
-        
-        messagebox.showinfo('Information', 'Report for '+self.exd.period+' '+self.exd.site+' was created')
-        
-    def print_template_4(self):
-        
-        skip = 30
-        
-        wb = load_workbook(filename = os.getcwd()+'/BaseFiles/Template_4.xlsx')
-        ws = wb.worksheets[0]
-
-        ws['C4'] = self.exd.site                                                # Project
-        ws['C5'] = self.exd.period                                              # Month
-        ws['C6'] = date.today()                                                 # Date of today
-
-        ws['C11'] = round(self.exd.biogas,1)                                             # Produced amount of biogas
-        ws['C12'] = round(self.exd.biogas_CH4,1)
-        ws['G11'] = round(self.exd.biomethane)
-        ws['G12'] = round(self.exd.biomethane_CH4)
-
-        ws['C15'] = self.exd.running                                            # Running Hours
-        ws['C16'] = self.exd.standby
-        ws['C17'] = '='+str(self.exd.trip)+'-C18-C19-C20'
-        ws['C18'] = 0
-        ws['C19'] = 0
-        ws['C20'] = 0
-        ws['C21'] = '=100*(1-((C17+C18+C19+C20)/(C15+C16+C17+C18+C19+C120)))'
-
-        ws['G15'] = self.exd.running_CO2LIQ
-        ws['G16'] = self.exd.standby_CO2LIQ
-        ws['G17'] = '='+str(self.exd.trip_CO2LIQ)+'-G18-G19-G20'
-        ws['G18'] = 0
-        ws['G19'] = 0
-        ws['G20'] = 0
-        ws['G21'] = '=100*(1-((G17+G18+G19+G20)/(G15+G16+G17+G18+G19+G20)))'
-                                
-        for i in range(skip,skip+len(self.exd.error_list)):
-            ws.insert_rows(idx = i)
-            ws.merge_cells(start_row=i, start_column=4, end_row=i, end_column=6)
-            thin = Side(border_style="thin", color="000000")
-            ws.cell(row = i, column = 2).border = Border(left = thin)
-            ws.cell(row = i, column = 8).border = Border(right = thin)
-            ws.cell(row = i, column = 2, value = self.exd.error_list['Date'][i-skip].strftime('%Y-%m-%d %H:%M'))
-            ws.cell(row = i, column = 3, value = math.ceil(100*self.exd.error_list['Duration'][i-skip].total_seconds()/60/60)/100)
-            ws.cell(row = i, column = 7, value = self.exd.error_list['endDate'][i-skip].strftime('%Y-%m-%d'))
-
-        wb.save(filename = self.exd.folder_location+'/'+self.exd.site+' - maandrapportage bedrijfsvoering '+self.exd.save_period+'.xlsx')
+        for file_location in sorted(glob.glob(os.path.join(self.folder, self.pattern)), key = os.path.getmtime):
+            try:
+                stat = os.stat(file_location)
+            except OSError: # removed in the meantime
+                continue
+            
+            signature = (stat.st_size, stat.st_mtime)
+            if self.done.get(file_location) == signature:
+                continue
+            
+            seen = self.seen.get(file_location)
+            if seen is None or seen[:2] != signature:
+                self.seen[file_location] = signature + (now,)
+            elif stat.st_size and now - seen[2] >= self.settle:
+                files.append(file_location)
+                self.done[file_location] = signature
+                del self.seen[file_location]
+        
+        return files
+    
+    def take(self, file_location):
+        '''
+        Queues the report of a settled file, unless its content was reported on before. Content that failed is
+        skipped for the rest of this run but tried again on the next run (e.g. with --site).
+        '''
+        
+        try:
+            digest = file_hash(file_location)
+        except OSError: # still locked or removed, try again at the next poll
+            self.done.pop(file_location, None)
+            return
+        
+        if self.ledger.get(digest, {}).get('status') == 'ok' or digest in self.failed:
+            return
+        if any(job['digest'] == digest for job in self.queue + list(self.running.values())):
+            return
+        
+        try:
+            site = detect_site(file_location, self.site)
+        except (OSError, UnicodeDecodeError, csv.Error) as error:
+            site, problem = None, f'{type(error).__name__}: {error}'
+        else:
+            problem = 'site not recognised from the file name or the columns, use --site'
+        
+        job = dict(self.options, site = site, csv = file_location, output = self.output, digest = digest)
+        if site is None:
+            self.record(digest, dict(job, status = 'failed', file = None, error = problem, seconds = None))
+        else:
+            self.queue.append(job)
+    
+    def dispatch(self, pool):
+        '''Submits waiting jobs while workers are free, one job per site at a time, in the order they arrived'''
+        
+        busy = {job['site'] for job in self.running.values()}
+        for job in list(self.queue):
+            if len(self.running) >= self.workers:
+                break
+            if job['site'] in busy:
+                continue
+            self.queue.remove(job)
+            self.running[pool.submit(run_report, job)] = job
+            busy.add(job['site'])
+    
+    def collect(self):
+        '''Records the finished reports'''
+        
+        for future in [future for future in self.running if future.done()]:
+            job = self.running.pop(future)
+            try:
+                result = future.result()
+            except Exception as error: # the worker process itself died
+                result = dict(job, status = 'failed', file = None, error = f'{type(error).__name__}: {error}', seconds = None)
+            self.record(job['digest'], result)
+    
+    def poll(self, pool, scan = True):
+        self.collect()
+        if scan:
+            for file_location in self.settled():
+                self.take(file_location)
+        self.dispatch(pool)
+    
+    def run(self, once = False):
+        '''
+        Watches the folder until it is interrupted (Ctrl+C), the reports that are running are finished first.
+        With once the files that are there now are reported on and the watch stops when they are done.
+        '''
         
-        messagebox.showinfo('Information', 'Report for '+self.exd.period+' '+self.exd.site+' was created')
+        print(f'Watching {os.path.abspath(self.folder)} for {self.pattern}, reports go to {os.path.abspath(self.output)}', flush = True)
+        
+        with ProcessPoolExecutor(max_workers = self.workers, initializer = ignore_interrupt) as pool:
+            try:
+                if once:
+                    for file_location in sorted(glob.glob(os.path.join(self.folder, self.pattern)), key = os.path.getmtime):
+                        self.take(file_location)
+                while True:
+                    self.poll(pool, scan = not once)
+                    if once and not (self.queue or self.running):
+                        break
+                    time.sleep(self.interval if not once else 0.1)
+            except KeyboardInterrupt:
+                print(f'Stopping, waiting for {len(self.running)} running reports', flush = True)
+                self.queue.clear()
+            
+            wait(self.running)
+            self.collect()
+
+def fleet_main(args):
+    '''Fleet overview of the command line, the exports of --manifest or --glob (the site of each from its name or columns)'''
+    
+    if not args.output:
+        raise SystemExit('--fleet needs --output')
+    
+    if args.manifest:
+        exports = [(job['site'], job['csv']) for job in read_manifest(args.manifest, require_output = False)]
+    else:
+        default = resolve_site(args.site) if args.site else None
+        exports = [(detect_site(file_location, default), file_location) for file_location in sorted(glob.glob(args.glob))]
+    
+    unknown = [file_location for site, file_location in exports if site is None]
+    if unknown:
+        raise SystemExit('Site not recognised from the file name or the columns, use a manifest or --site: '+', '.join(unknown))
+    
+    os.makedirs(args.output, exist_ok = True)
+    start = time.perf_counter()
+    results, file_name = fleet(exports, args.output, args.workers, args.aggregation, args.trip_index)
+    total = time.perf_counter() - start
+    
+    for result in results:
+        if result['status'] == 'ok':
+            availability = '-' if result['availability'] is None else f"{result['availability']:.1f} %"
+            if result['methane_slip'] is not None:
+                slip = f"{result['methane_slip']:.2f} %"
+            elif result['methane_slip_measured'] is not None:
+                slip = f"{result['methane_slip_measured']:.2f} g/Nm3"
+            else:
+                slip = '-'
+            intensity = '-' if result['energy_intensity'] is None else f"{result['energy_intensity']:.3f} kWh/Nm3"
+            print(f"ok     {result['site']:36} {result['month']}  availability {availability:>7}  slip {slip:>11}  {intensity:>15}  {result['trips']:>4} trips")
+        else:
+            print(f"failed {result['site']:36} {result['csv']} -> {result['error']}")
+    
+    failed = sum(result['status'] != 'ok' for result in results)
+    print(f'{len(results)} exports, {failed} failed in {total:.1f} s, fleet overview -> {file_name}')
+    
+    if args.summary:
+        with open(args.summary, 'w') as file:
+            json.dump({'seconds': round(total, 3), 'failed': failed, 'file': file_name, 'exports': results}, file, indent = 2)
+    
+    return 1 if failed else 0
+
+def trips_main(args):
+    '''Queries the trip index of a site, with --context the data around each trip is written to --output'''
+    
+    site = resolve_site(args.trips)
+    index = TripIndex()
+    
+    if args.overlaps:
+        trips = index.overlaps(site)
+    elif args.longest:
+        trips = index.longest(site, args.longest)
+    else:
+        trips = index.trips(site, args.since, args.until)
+    
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(trips.drop(columns = 'source', errors = 'ignore').to_string(index = False) if len(trips) else 'No trips')
+    
+    if args.context and len(trips):
+        if not args.output or args.overlaps:
+            raise SystemExit('--context needs --output and can not be combined with --overlaps')
+        os.makedirs(args.output, exist_ok = True)
+        for _, trip in trips.iterrows():
+            window = index.context(trip, f'{args.context}min', f'{args.context}min')
+            name = f"{site.split(' - ')[0]} {trip['tag']} {trip['Date']:%Y-%m-%d %H%M%S}.csv"
+            if window is None:
+                print(f'not in the export cache: {name}')
+            else:
+                window.to_csv(os.path.join(args.output, name))
+    
+    return 0
+
+def ignore_interrupt():
+    '''Initializer of the watch workers: Ctrl+C stops the watch, the reports that are running are finished'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def watch_main(args):
+    if not args.output:
+        raise SystemExit('--watch needs --output')
+    if args.rollup and args.month_to_date:
+        raise SystemExit('--rollup and --month-to-date can not be combined')
+    
+    watcher = FolderWatcher(args.watch, args.output, args.glob or '*.csv', args.workers, args.interval, args.settle,
+                            resolve_site(args.site) if args.site else None, job_options(args))
+    watcher.run(once = args.once)
+    return 0
 
 '''This starts up an instance of our application'''
 
-def main():
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'BURP - Biogas Upgrading Report Program. Without arguments the GUI is started.')
+    parser.add_argument('--manifest', help = 'csv or json file with a site, csv and output entry per report')
+    parser.add_argument('--glob', help = 'file pattern of the exports to report on, use together with --site and --output')
+    parser.add_argument('--site', help = 'site name or site code (e.g. B0933) of the --glob exports')
+    parser.add_argument('--output', help = 'output folder of the --glob reports')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes, default one per CPU')
+    parser.add_argument('--summary', help = 'also write the summary to this json file')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'always parse the csv instead of using the export cache')
+    parser.add_argument('--month-to-date', action = 'store_true', help = 'update the month to date reports with the new rows of the exports')
+    parser.add_argument('--rollup', action = 'store_true', help = 'split long exports by calendar month, with a report per month and a summary workbook')
+    parser.add_argument('--aggregation', choices = AGGREGATIONS, help = "'grid' resamples to 5 minutes, 'time' weights the raw samples by the time they hold; default from the recipe of the site")
+    parser.add_argument('--profile', action = 'store_true', help = 'write a timing report of the stages next to every workbook')
+    parser.add_argument('--trip-index', action = 'store_true', help = 'add the trips of every export to the trip index in '+TRIP_INDEX_FOLDER)
+    parser.add_argument('--output-format', choices = list(OUTPUT_FORMATS), default = 'xlsx', help = "'xlsx' fills in the template, 'json', 'csv' and 'xlsx-stream' only write the KPIs and the trips")
+    parser.add_argument('--watch', help = 'keep watching this folder and report on every new export, with --output (and --glob as the file pattern)')
+    parser.add_argument('--interval', type = float, default = 5, help = 'seconds between the polls of the watched folder')
+    parser.add_argument('--settle', type = float, default = 10, help = 'seconds a new file must stay unchanged before it is reported on')
+    parser.add_argument('--once', action = 'store_true', help = 'with --watch, report on the files that are there now and stop')
+    parser.add_argument('--trips', metavar = 'SITE', help = 'list the trips of a site from the trip index, in the period of --since and --until')
+    parser.add_argument('--since', help = 'with --trips, start of the period (e.g. 2024-03-01)')
+    parser.add_argument('--until', help = 'with --trips, end of the period')
+    parser.add_argument('--longest', type = int, help = 'with --trips, only the longest trips')
+    parser.add_argument('--overlaps', action = 'store_true', help = 'with --trips, the trips of the unit that overlap trips of the CO2 liquefaction')
+    parser.add_argument('--context', type = float, help = 'with --trips, write the data from this many minutes before to after each trip to --output')
+    parser.add_argument('--fleet', action = 'store_true', help = 'compare the exports of --manifest or --glob in one fleet overview in --output, without reports per site')
+    args = parser.parse_args(argv)
+    
+    if args.watch:
+        return watch_main(args)
+    
+    if args.trips:
+        return trips_main(args)
+    
+    if args.fleet:
+        if not (args.manifest or args.glob):
+            raise SystemExit('--fleet needs --manifest or --glob')
+        return fleet_main(args)
+    
+    if args.manifest or args.glob:
+        return batch_main(args)
+    
     tool = MonthlyReportingTool()
     tool.mainloop()
+    return 0
 
 if __name__ =='__main__':
-    main()
-    
-    
-    
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import BURP_v9 as burp
+
+def counters(**columns):
+    length = len(next(iter(columns.values())))
+    return pd.DataFrame(dict(time = pd.date_range('2024-03-01 22:00', periods = length, freq = '1h'), **columns))
+
+def test_steps_up_and_jitter():
+    totals, daily = burp.integrate_counters(counters(Energy = [100.0, 110.0, 109.5, 109.8, 120.0]), ['Energy'])
+    assert totals['Energy'] == pytest.approx(10 + 0.3 + 10.2) # the jitter down adds nothing
+    assert daily['Energy'].tolist() == pytest.approx([10, 10.5]) # booked at the second sample of a step
+    assert list(daily.index.astype(str)) == ['2024-03-01', '2024-03-02']
+
+def test_reset_counts_from_zero():
+    totals, daily = burp.integrate_counters(counters(Energy = [1000.0, 1010.0, 5.0, 15.0]), ['Energy'])
+    assert totals['Energy'] == pytest.approx(10 + 5 + 10)
+
+def test_dropout_is_held():
+    totals, daily = burp.integrate_counters(counters(Energy = [1000.0, 1010.0, 0.0, 1020.0, 1030.0]), ['Energy'])
+    assert totals['Energy'] == pytest.approx(30)
+
+def test_rollover_per_column():
+    df = counters(Energy = [990.0, 995.0, 3.0, 8.0], Energy_CO2 = [990.0, 995.0, 3.0, 8.0])
+    totals, daily = burp.integrate_counters(df, ['Energy', 'Energy_CO2'], rollover = {'Energy': 1000})
+    assert totals['Energy'] == pytest.approx(5 + (1000 - 995) + 3 + 5)
+    assert totals['Energy_CO2'] == pytest.approx(5 + 3 + 5) # no rollover known, a reset
+    
+    totals, daily = burp.integrate_counters(df, ['Energy', 'Energy_CO2'], rollover = 1000)
+    assert totals.tolist() == pytest.approx([18, 18])
+
+def test_initial_values():
+    totals, daily = burp.integrate_counters(counters(Energy = [110.0, 120.0]), ['Energy'], initial = [100.0])
+    assert totals['Energy'] == pytest.approx(20)
+
+def test_rollover_from_the_recipe(tmp_path):
+    with open(os.path.join(burp.BASE_FOLDER, 'recipes.json')) as file:
+        config = json.load(file)
+    site = 'B0565 - Delfland Houtrust'
+    for entry in config['sites'][site]['kpis']:
+        if isinstance(entry, dict) and entry['kpi'] == 'energy':
+            entry['rollover'] = {'Energy': 1000000}
+    recipes = str(tmp_path/'recipes.json')
+    with open(recipes, 'w') as file:
+        json.dump(config, file)
+    
+    columns = burp.load_recipes(recipes).get(site).columns
+    time = pd.date_range('2024-03-01', periods = 13, freq = '5min')
+    df = pd.DataFrame({column: 1.0 for column in columns}, index = range(len(time)))
+    df.insert(0, 'time', time)
+    df['Energy'] = [999990.0 + 5*step for step in range(len(time))]
+    df['Energy'] = df['Energy'] % 1000000 # rolls over after the third step
+    df.to_csv(tmp_path/'export.csv', index = False)
+    
+    report = burp.StandardizedReport(site, str(tmp_path/'export.csv'), str(tmp_path), cache = False, recipes = recipes)
+    assert report.total_energy == pytest.approx(5*(len(time)-1))
+    
+    config['sites'][site]['kpis'][-1]['rollover'] = {'Energy_unknown': 1000}
+    with open(recipes, 'w') as file:
+        json.dump(config, file)
+    burp._recipe_books.clear()
+    with pytest.raises(ValueError):
+        burp.load_recipes(recipes)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import BURP_v9 as burp
+
+def create_error_list_loop(dataframe, tag):
+    '''The row by row loop that create_error_list used before detect_events, kept as the reference'''
+    
+    df = dataframe
+    Error = False
+    time_start = []
+    time_duration = []
+    time_end = []
+    Error_data = []
+    i = 0
+    
+    for index, row in df.iterrows():
+        
+        if (row[tag] == 90 or row[tag] == 99) and Error == False:
+            Error = True
+            time_start = row['time']
+            Error_data.append(row['time'])
+            time_duration.append(row['time'] - time_start)
+            time_end.append(row['time'])
+        elif (row[tag] == 90 or row[tag] == 99):
+            Error = True
+        elif (row[tag] != 90 or row[tag] != 99) and Error == True:
+            time_duration[i] = (row['time'] - time_start)
+            time_end[i] = (row['time'])
+            i = i+1
+            Error = False
+        else:
+            Error = False
+    
+    trip_data = pd.DataFrame([Error_data, time_duration, time_end]).T
+    trip_data.columns = ['Date','Duration', 'endDate']
+    
+    return trip_data
+
+def typed(trip_data):
+    return pd.DataFrame({'Date': pd.to_datetime(trip_data['Date']).astype('datetime64[ns]'),
+                         'Duration': pd.to_timedelta(trip_data['Duration']).astype('timedelta64[ns]'),
+                         'endDate': pd.to_datetime(trip_data['endDate']).astype('datetime64[ns]')})
+
+def export(states):
+    return pd.DataFrame({'time': pd.date_range('2024-03-01', periods = len(states), freq = '10s'),
+                         'SEQSTATE': np.array(states, dtype = float),
+                         'SEQSTATE_CO2': np.array(states, dtype = float)})
+
+CASES = {
+    'back to back codes': [62, 62, 90, 99, 99, 90, 62, 62, 99, 62],
+    'trip in the first row': [90, 90, 62, 62, 99, 1, 1, 62],
+    'missing values': [62, np.nan, 90, np.nan, 62, 99, 99, 20, 20],
+    'no trips': [62, 62, 1, 1, 20, 62],
+    }
+
+@pytest.mark.parametrize('states', CASES.values(), ids = CASES.keys())
+@pytest.mark.parametrize('tag', ['SEQSTATE', 'SEQSTATE_CO2'])
+def test_same_trips_as_the_loop(states, tag):
+    df = export(states)
+    expected = typed(create_error_list_loop(df, tag))
+    result = burp.StandardizedReport.create_error_list(None, df, tag)
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_random_states_same_trips_as_the_loop():
+    rng = np.random.default_rng(0)
+    states = rng.choice([1, 20, 62, 90, 99], size = 2000, p = [0.2, 0.2, 0.4, 0.1, 0.1])
+    states[-1] = 62 # no trip open at the end, see below
+    df = export(states)
+    for tag in ('SEQSTATE', 'SEQSTATE_CO2'):
+        expected = typed(create_error_list_loop(df, tag))
+        pd.testing.assert_frame_equal(burp.StandardizedReport.create_error_list(None, df, tag), expected)
+
+def test_trip_open_at_the_end():
+    '''The only intended difference: the loop gave an open trip no duration, now it lasts until the last sample'''
+    
+    df = export([62, 62, 90, 99, 62, 62, 99, 90, 90])
+    expected = typed(create_error_list_loop(df, 'SEQSTATE'))
+    result = burp.StandardizedReport.create_error_list(None, df, 'SEQSTATE')
+    
+    pd.testing.assert_frame_equal(result.iloc[:-1], expected.iloc[:-1])
+    assert expected['Date'].iloc[-1] == expected['endDate'].iloc[-1] == df['time'].iloc[6]
+    assert (result['Date'].iloc[-1], result['endDate'].iloc[-1]) == (df['time'].iloc[6], df['time'].iloc[-1])
+    assert result['Duration'].iloc[-1] == pd.Timedelta(seconds = 20)
@@ -0,0 +1,58 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import BURP_v9 as burp
+
+def test_mask_range():
+    values = np.array([1.0, 5.0, 7.5, 10.0, np.nan, 12.0])
+    np.testing.assert_array_equal(burp.mask_range(values, 5, 10), [np.nan, 5.0, 7.5, 10.0, np.nan, np.nan])
+    np.testing.assert_array_equal(burp.mask_range(values, 5, 10, inclusive = False), [np.nan, np.nan, 7.5, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(burp.mask_range(values, low = 7), [np.nan, np.nan, 7.5, 10.0, np.nan, 12.0])
+    assert burp.mask_range(np.array([1, 2, 3]), high = 2).dtype == np.float64
+
+def test_interpolate_gaps_like_pandas():
+    values = np.array([np.nan, 1.0, np.nan, np.nan, 4.0, np.nan, 2.0, np.nan, np.nan])
+    expected = pd.Series(values).interpolate(method = 'linear').to_numpy()
+    np.testing.assert_array_equal(burp.interpolate_gaps(values), expected)
+    assert np.isnan(burp.interpolate_gaps(np.full(3, np.nan))).all()
+
+def test_metric_declaration():
+    with pytest.raises(ValueError):
+        burp.Metric('not a name', 'H2S_in')
+    
+    df = pd.DataFrame({'SEQSTATE': [62.0, 62.0, 62.0, 1.0], 'H2S_in': [10.0, 2.0, 30.0, 50.0], 'RHA10CF001': [1.0, 1.0, 3.0, 1.0]})
+    metric = burp.Metric('mean_H2S_treated', 'H2S_in', states = {'SEQSTATE': 62}, weight = 'RHA10CF001', low = 5, interpolate = True)
+    np.testing.assert_array_equal(metric.values(df), [10.0, 20.0, 30.0, 50.0])
+    
+    values = pd.DataFrame({metric.key: metric.values(df), 'RHA10CF001': df['RHA10CF001']})
+    aggregate = burp.StateAggregate(df[['SEQSTATE']], values, weights = {metric.key: 'RHA10CF001'})
+    assert metric.value(aggregate) == pytest.approx((10 + 20 + 3*30)/5)
+
+def test_metric_on_a_state_column_of_its_own(tmp_path):
+    '''A metric that selects on a state column that no other KPI of the recipe reads'''
+    
+    with open(os.path.join(burp.BASE_FOLDER, 'recipes.json')) as file:
+        config = json.load(file)
+    config['sites']['B0175 - Aquafin NV']['kpis'].append(
+        {'kpi': 'metric', 'name': 'slip_co2', 'column': 'Methane_slip', 'states': {'SEQSTATE_CO2': 20}})
+    recipes = str(tmp_path/'recipes.json')
+    with open(recipes, 'w') as file:
+        json.dump(config, file)
+    
+    recipe = burp.load_recipes(recipes).get('B0175 - Aquafin NV')
+    assert {'SEQSTATE_CO2', 'Methane_slip'} <= set(recipe.columns)
+    
+    time = pd.date_range('2024-03-01', periods = 24*12, freq = '5min')
+    df = pd.DataFrame({column: 1.0 for column in recipe.columns}, index = range(len(time)))
+    df.insert(0, 'time', time)
+    df['SEQSTATE'] = 62.0
+    df['SEQSTATE_CO2'] = np.where(np.arange(len(time)) % 2, 20.0, 2.0)
+    df['Methane_slip'] = np.where(np.arange(len(time)) % 2, 0.5, 3.0)
+    df.to_csv(tmp_path/'export.csv', index = False)
+    
+    report = burp.StandardizedReport('B0175 - Aquafin NV', str(tmp_path/'export.csv'), str(tmp_path), cache = False, recipes = recipes)
+    assert report.slip_co2 == pytest.approx(0.5)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+import BURP_v9 as burp
+
+def export():
+    time = pd.date_range('2024-03-01', periods = 24*60, freq = '1min')
+    df = pd.DataFrame({'time': time, 'SEQSTATE': 62.0, 'RHA10CF001': np.arange(len(time), dtype = float),
+                       'Energy': np.arange(len(time), dtype = float)})
+    df.loc[(time >= '2024-03-01 02:00') & (time < '2024-03-01 10:00'), 'RHA10CF001'] = 500.0 # flat over the first split
+    df.loc[time >= '2024-03-01 16:00', 'Energy'] -= 1000.0 # reset at the second split
+    return df[(time <= '2024-03-01 12:00') | (time >= '2024-03-01 14:00')].reset_index(drop = True) # gap at the third split
+
+def month_to_date(df, splits):
+    '''The quality in parts, like MonthToDateReport.check_quality'''
+    
+    quality, previous = None, None
+    for first, last in zip([0] + splits, splits + [len(df)]):
+        part = df.iloc[first:last]
+        if quality is None:
+            quality = burp.data_quality(part)
+        else:
+            later = burp.data_quality(pd.concat([previous, part], ignore_index = True), last_change = quality['last_change'])
+            later['rows'] -= 1
+            quality = burp.combine_quality(quality, later)
+        previous = part.iloc[[-1]]
+    return quality
+
+def test_split_quality_equals_full_quality():
+    df = export()
+    splits = [int(np.searchsorted(df['time'], pd.Timestamp(split))) for split in ('2024-03-01 06:00', '2024-03-01 16:00', '2024-03-01 14:00')]
+    full = burp.data_quality(df)
+    assert (full['gaps'], full['gap_hours']) == (1, 2.0)
+    assert full['flatlines']['RHA10CF001'] == {'count': 1, 'hours': 8.0, 'longest_hours': 8.0}
+    assert full['counters']['Energy']['resets'] == 1
+    
+    assert month_to_date(df, sorted(splits)) == full
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+import BURP_v9 as burp
+
+def export(first, periods):
+    time = pd.date_range(first, periods = periods, freq = '1min')
+    df = pd.DataFrame({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'SEQSTATE': 62.0,
+                       'RHA10CF001': np.arange(periods, dtype = float), 'Energy': np.arange(periods, dtype = float)})
+    df.loc[df.index % 7 == 3, 'RHA10CF001'] = np.nan # gaps to fill across the offset
+    return df
+
+def test_offset_skips_the_earlier_lines(tmp_path):
+    path = str(tmp_path / 'export.csv')
+    export('2024-03-01', 500).to_csv(path, index = False)
+    earlier = burp.read_export(path, chunksize = 64)
+    end = burp.export_end(path)
+    
+    export('2024-03-01 08:20', 300).to_csv(path, mode = 'a', header = False, index = False) # the month so far grows
+    offset = burp.export_offset(path, end)
+    assert offset == end['offset']
+    
+    initial = earlier.iloc[-1]
+    later = burp.read_export(path, chunksize = 64, since = initial['time'], initial = initial, offset = offset)
+    full = burp.read_export(path, chunksize = 64)
+    pd.testing.assert_frame_equal(later, full.iloc[len(earlier):].reset_index(drop = True))
+    
+    assert burp.read_export(path, offset = burp.export_end(path)['offset'], since = full['time'].iloc[-1]).empty
+
+def test_rewritten_export_is_read_from_the_start(tmp_path):
+    path = str(tmp_path / 'export.csv')
+    export('2024-03-01', 500).to_csv(path, index = False)
+    end = burp.export_end(path)
+    
+    export('2024-03-02', 600).to_csv(path, index = False) # another export, longer but not grown
+    assert burp.export_offset(path, end) == 0
+    export('2024-03-01', 100).to_csv(path, index = False)
+    assert burp.export_offset(path, end) == 0
+    assert burp.export_offset(path, None) == 0
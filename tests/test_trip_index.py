@@ -0,0 +1,74 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import BURP_v9 as burp
+import BURP_benchmark
+
+SITE = 'B0933 - Dommel'
+
+@pytest.fixture
+def export(tmp_path):
+    file_location = str(tmp_path/'export.csv')
+    BURP_benchmark.generate_export(file_location, burp.load_recipes().get(SITE).columns, rate = '1min', duration = '2D', trips_per_day = 10)
+    return file_location
+
+def indexed(index):
+    tags, counts = np.unique(index.records(SITE)['tag'], return_counts = True)
+    return dict(zip(tags, counts))
+
+def test_trip_index_from_the_cache(tmp_path, export):
+    pytest.importorskip('pyarrow')
+    cache = burp.ExportCache(str(tmp_path/'cache'))
+    index = burp.TripIndex(str(tmp_path/'trips'))
+    
+    events = burp.trip_events(burp.read_export(export, burp.load_recipes().get(SITE).columns))
+    expected = {tag: len(trips) for tag, (trips, last_open) in events.items()}
+    assert expected['SEQSTATE'] > 0
+    
+    burp.StandardizedReport(SITE, export, str(tmp_path), cache = cache) # a plain run fills the cache
+    assert not os.path.exists(index.file(SITE))
+    
+    profiler = burp.StageProfiler(memory = False)
+    burp.StandardizedReport(SITE, export, str(tmp_path), cache = cache, profiler = profiler, trip_index = index)
+    stages = [stage['stage'] for stage in profiler.stages]
+    assert 'index_trips' in stages and 'import_csv' not in stages
+    assert indexed(index) == expected
+    
+    # An entry that was stored without the trips of the state columns is parsed again
+    os.remove(index.file(SITE))
+    for events_file in glob.glob(str(tmp_path/'cache'/'*'/'events.arrow')):
+        os.remove(events_file)
+    burp.StandardizedReport(SITE, export, str(tmp_path), cache = cache, trip_index = index)
+    assert indexed(index) == expected
+
+def month(start, states):
+    return pd.DataFrame({'time': pd.date_range(start, periods = len(states), freq = '10min'),
+                         'SEQSTATE': np.array(states, dtype = float)})
+
+def trips(index):
+    records = index.records(SITE)
+    return [(str(record['start']), str(record['end']), bool(record['open'])) for record in records]
+
+@pytest.mark.parametrize('order', [[0, 1], [0, 1, 0], [0, 1, 1], [0, 1, 0, 1], [0, 1, 2, 1, 0, 2]])
+def test_indexing_an_export_again(tmp_path, order):
+    '''Indexing the exports again, in any order after they were indexed in order, gives the trips of all data together'''
+    
+    exports = [month('2024-01-31 22:00', [62, 90, 62, 62, 62, 62, 62, 62, 62, 99, 90, 90]), # open at the end
+               month('2024-02-01 00:00', [90, 90, 99, 62, 62, 62, 90, 62, 62, 62, 62, 99]), # continues, open again
+               month('2024-02-01 02:00', [62, 62, 62, 62, 90, 90])]
+    
+    expected = burp.TripIndex(str(tmp_path/'all'))
+    data = pd.concat([exports[number] for number in sorted(set(order))], ignore_index = True)
+    expected.update(SITE, burp.trip_events(data), data['time'].iloc[0], data['time'].iloc[-1])
+    
+    index = burp.TripIndex(str(tmp_path/'parts'))
+    for number in sorted(set(order)) + order:
+        df = exports[number]
+        index.update(SITE, burp.trip_events(df), df['time'].iloc[0], df['time'].iloc[-1])
+    
+    assert trips(index) == trips(expected)
+    assert ('2024-01-31T23:30:00.000000000', '2024-02-01T00:30:00.000000000', False) in trips(index)
@@ -0,0 +1,38 @@
+import BURP_v9 as burp
+
+def export(folder):
+    file_location = folder/'onbekend.csv'
+    file_location.write_text('time,X\n2024-03-01 00:00:00,1\n')
+    return str(file_location)
+
+def test_failed_export_is_retried_on_the_next_run(tmp_path):
+    file_location = export(tmp_path)
+    output = str(tmp_path/'out')
+    
+    watcher = burp.FolderWatcher(str(tmp_path), output)
+    watcher.take(file_location)
+    digest = burp.file_hash(file_location)
+    assert watcher.ledger[digest]['status'] == 'failed'
+    assert not watcher.queue
+    
+    watcher.take(file_location) # not again in the same run
+    assert not watcher.queue
+    
+    site = burp.load_recipes().sites[0]
+    watcher = burp.FolderWatcher(str(tmp_path), output, site = site)
+    watcher.take(file_location)
+    assert [(job['site'], job['digest']) for job in watcher.queue] == [(site, digest)]
+
+def test_reported_export_is_skipped(tmp_path):
+    file_location = export(tmp_path)
+    output = str(tmp_path/'out')
+    site = burp.load_recipes().sites[0]
+    
+    watcher = burp.FolderWatcher(str(tmp_path), output, site = site)
+    watcher.take(file_location)
+    job = watcher.queue.pop()
+    watcher.record(job['digest'], dict(job, status = 'ok', file = 'report.xlsx', error = None, seconds = 1.0))
+    
+    watcher = burp.FolderWatcher(str(tmp_path), output, site = site)
+    watcher.take(file_location)
+    assert not watcher.queue